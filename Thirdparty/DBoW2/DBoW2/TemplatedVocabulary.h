@@ -26,6 +26,12 @@
 #include <algorithm>
 #include <opencv2/core/core.hpp>
 #include <limits>
+#include <cstring>
+#include <stdint.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 #include "FeatureVector.h"
 #include "BowVector.h"
@@ -246,6 +252,22 @@ public:
    */
   void saveToTextFile(const std::string &filename) const;  
 
+  /**
+   * Loads the vocabulary from a binary file written by saveToBinaryFile.
+   * The file is memory-mapped and node descriptors point into the mapping,
+   * so processes loading the same file share those pages.
+   * Only for descriptors stored as cv::Mat of F::L bytes (e.g. FORB)
+   * @param filename
+   */
+  bool loadFromBinaryFile(const std::string &filename);
+
+  /**
+   * Saves the vocabulary into a binary file
+   * Only for descriptors stored as cv::Mat of F::L bytes (e.g. FORB)
+   * @param filename
+   */
+  bool saveToBinaryFile(const std::string &filename) const;
+
   /**
    * Saves the vocabulary into a file
    * @param filename
@@ -425,6 +447,13 @@ protected:
   /// Words of the vocabulary (tree leaves)
   /// this condition holds: m_words[wid]->word_id == wid
   std::vector<Node*> m_words;
+
+  /// Binary vocabulary file mapped by loadFromBinaryFile (NULL if none)
+  void *m_mapped;
+  size_t m_mapped_size;
+
+  /// Unmaps the binary vocabulary file, if any
+  void releaseMapping();
   
 };
 
@@ -434,7 +463,7 @@ template<class TDescriptor, class F>
 TemplatedVocabulary<TDescriptor,F>::TemplatedVocabulary
   (int k, int L, WeightingType weighting, ScoringType scoring)
   : m_k(k), m_L(L), m_weighting(weighting), m_scoring(scoring),
-  m_scoring_object(NULL)
+  m_scoring_object(NULL), m_mapped(NULL), m_mapped_size(0)
 {
   createScoringObject();
 }
@@ -443,7 +472,8 @@ TemplatedVocabulary<TDescriptor,F>::TemplatedVocabulary
 
 template<class TDescriptor, class F>
 TemplatedVocabulary<TDescriptor,F>::TemplatedVocabulary
-  (const std::string &filename): m_scoring_object(NULL)
+  (const std::string &filename): m_scoring_object(NULL), m_mapped(NULL),
+  m_mapped_size(0)
 {
   load(filename);
 }
@@ -452,7 +482,8 @@ TemplatedVocabulary<TDescriptor,F>::TemplatedVocabulary
 
 template<class TDescriptor, class F>
 TemplatedVocabulary<TDescriptor,F>::TemplatedVocabulary
-  (const char *filename): m_scoring_object(NULL)
+  (const char *filename): m_scoring_object(NULL), m_mapped(NULL),
+  m_mapped_size(0)
 {
   load(filename);
 }
@@ -516,7 +547,7 @@ void TemplatedVocabulary<TDescriptor,F>::setWeightingType(WeightingType type)
 template<class TDescriptor, class F>
 TemplatedVocabulary<TDescriptor,F>::TemplatedVocabulary(
   const TemplatedVocabulary<TDescriptor, F> &voc)
-  : m_scoring_object(NULL)
+  : m_scoring_object(NULL), m_mapped(NULL), m_mapped_size(0)
 {
   *this = voc;
 }
@@ -527,6 +558,8 @@ template<class TDescriptor, class F>
 TemplatedVocabulary<TDescriptor,F>::~TemplatedVocabulary()
 {
   delete m_scoring_object;
+  m_nodes.clear();
+  releaseMapping();
 }
 
 // --------------------------------------------------------------------------
@@ -547,6 +580,13 @@ TemplatedVocabulary<TDescriptor,F>::operator=
   this->m_words.clear();
   
   this->m_nodes = voc.m_nodes;
+  if(voc.m_mapped)
+  {
+    // do not keep pointers into the mapping of voc
+    for(size_t i = 0; i < m_nodes.size(); ++i)
+      m_nodes[i].descriptor = m_nodes[i].descriptor.clone();
+  }
+  if(this != &voc) this->releaseMapping();
   this->createWords();
   
   return *this;
@@ -1450,6 +1490,192 @@ void TemplatedVocabulary<TDescriptor,F>::saveToTextFile(const std::string &filen
 
 // --------------------------------------------------------------------------
 
+// Binary vocabulary layout (native endianness):
+//   header (64 bytes): magic "DBoW2BIN", version, k, L, scoring, weighting,
+//     descriptor bytes, number of nodes N (without the root)
+//   N doubles: node weights
+//   N * F::L bytes: node descriptors
+//   N uint32: node parents
+//   N uint8: 1 if the node is a word, 0 otherwise
+// Nodes are stored in id order starting at 1, as in the text format.
+
+struct BinaryVocabularyHeader
+{
+  char magic[8];
+  int32_t version;
+  int32_t k;
+  int32_t L;
+  int32_t scoring;
+  int32_t weighting;
+  int32_t descriptor_bytes;
+  uint64_t nodes;
+  char reserved[24];
+};
+
+static const char BINARY_VOCABULARY_MAGIC[8] = {'D','B','o','W','2','B','I','N'};
+
+template<class TDescriptor, class F>
+bool TemplatedVocabulary<TDescriptor,F>::saveToBinaryFile(const std::string &filename) const
+{
+  fstream f;
+  f.open(filename.c_str(), ios_base::out | ios_base::binary);
+  if(!f.is_open()) return false;
+
+  const uint64_t N = m_nodes.empty() ? 0 : m_nodes.size() - 1;
+
+  BinaryVocabularyHeader header;
+  memset(&header, 0, sizeof(header));
+  memcpy(header.magic, BINARY_VOCABULARY_MAGIC, sizeof(header.magic));
+  header.version = 1;
+  header.k = m_k;
+  header.L = m_L;
+  header.scoring = m_scoring;
+  header.weighting = m_weighting;
+  header.descriptor_bytes = F::L;
+  header.nodes = N;
+  f.write((const char*)&header, sizeof(header));
+
+  for(size_t i = 1; i <= N; ++i)
+  {
+    double weight = m_nodes[i].weight;
+    f.write((const char*)&weight, sizeof(weight));
+  }
+  for(size_t i = 1; i <= N; ++i)
+  {
+    const cv::Mat d = m_nodes[i].descriptor.isContinuous() ?
+      m_nodes[i].descriptor : m_nodes[i].descriptor.clone();
+    if(d.total() * d.elemSize() != (size_t)F::L) return false;
+    f.write((const char*)d.data, F::L);
+  }
+  for(size_t i = 1; i <= N; ++i)
+  {
+    uint32_t parent = m_nodes[i].parent;
+    f.write((const char*)&parent, sizeof(parent));
+  }
+  for(size_t i = 1; i <= N; ++i)
+  {
+    uint8_t is_leaf = m_nodes[i].isLeaf() ? 1 : 0;
+    f.write((const char*)&is_leaf, sizeof(is_leaf));
+  }
+
+  f.close();
+  return !f.fail();
+}
+
+// --------------------------------------------------------------------------
+
+template<class TDescriptor, class F>
+bool TemplatedVocabulary<TDescriptor,F>::loadFromBinaryFile(const std::string &filename)
+{
+  int fd = open(filename.c_str(), O_RDONLY);
+  if(fd < 0) return false;
+
+  struct stat st;
+  if(fstat(fd, &st) != 0 || (size_t)st.st_size < sizeof(BinaryVocabularyHeader))
+  {
+    close(fd);
+    return false;
+  }
+
+  const size_t size = st.st_size;
+  void *mapped = mmap(NULL, size, PROT_READ, MAP_SHARED, fd, 0);
+  close(fd);
+  if(mapped == MAP_FAILED) return false;
+
+  const char *data = (const char*)mapped;
+  BinaryVocabularyHeader header;
+  memcpy(&header, data, sizeof(header));
+
+  const uint64_t N = header.nodes;
+  if(memcmp(header.magic, BINARY_VOCABULARY_MAGIC, sizeof(header.magic)) != 0 ||
+    header.version != 1 || header.descriptor_bytes != F::L ||
+    size != sizeof(header) + N * (sizeof(double) + F::L + sizeof(uint32_t) + 1))
+  {
+    std::cerr << "Vocabulary loading failure: This is not a correct binary file!" << endl;
+    munmap(mapped, size);
+    return false;
+  }
+
+  const char *weights = data + sizeof(header);
+  const char *descriptors = weights + N * sizeof(double);
+  const char *parents = descriptors + N * F::L;
+  const uint8_t *leafs = (const uint8_t*)(parents + N * sizeof(uint32_t));
+
+  // parents always precede their children
+  for(size_t i = 0; i < N; ++i)
+  {
+    uint32_t pid;
+    memcpy(&pid, parents + i * sizeof(uint32_t), sizeof(uint32_t));
+    if(pid > i)
+    {
+      std::cerr << "Vocabulary loading failure: This is not a correct binary file!" << endl;
+      munmap(mapped, size);
+      return false;
+    }
+  }
+
+  m_words.clear();
+  m_nodes.clear();
+  releaseMapping();
+  m_mapped = mapped;
+  m_mapped_size = size;
+
+  m_k = header.k;
+  m_L = header.L;
+  m_scoring = (ScoringType)header.scoring;
+  m_weighting = (WeightingType)header.weighting;
+  createScoringObject();
+
+  m_nodes.resize(N + 1);
+  m_nodes[0].id = 0;
+
+  size_t n_words = 0;
+  for(size_t i = 0; i < N; ++i) n_words += leafs[i];
+  m_words.reserve(n_words);
+
+  for(size_t i = 0; i < N; ++i)
+  {
+    const NodeId nid = i + 1;
+    Node &node = m_nodes[nid];
+    node.id = nid;
+
+    double weight;
+    memcpy(&weight, weights + i * sizeof(double), sizeof(double));
+    node.weight = weight;
+
+    uint32_t pid;
+    memcpy(&pid, parents + i * sizeof(uint32_t), sizeof(uint32_t));
+    node.parent = pid;
+    m_nodes[pid].children.push_back(nid);
+
+    // header on the mapped bytes, nothing is copied
+    node.descriptor = cv::Mat(1, F::L, CV_8U, (void*)(descriptors + i * F::L));
+
+    if(leafs[i] > 0)
+    {
+      node.word_id = m_words.size();
+      m_words.push_back(&node);
+    }
+  }
+
+  return true;
+}
+
+// --------------------------------------------------------------------------
+
+template<class TDescriptor, class F>
+void TemplatedVocabulary<TDescriptor,F>::releaseMapping()
+{
+  if(m_mapped)
+  {
+    munmap(m_mapped, m_mapped_size);
+    m_mapped = NULL;
+    m_mapped_size = 0;
+  }
+}
+
+// --------------------------------------------------------------------------
+
 template<class TDescriptor, class F>
 void TemplatedVocabulary<TDescriptor,F>::save(const std::string &filename) const
 {
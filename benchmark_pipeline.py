@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from contextlib import redirect_stdout
+from frame_action import FrameAction
+from ego_store import EgoStore, EgoStoreWriter
+from extract_valid_positions import extract
+from extract_examples import find_example_windows, transform_windows
+
+
+def random_quaternions(n, rng, step=0.002):
+    """Slowly rotating unit quaternions (q0 q1 q2 q3, w last as in the TUM files)."""
+    q = np.cumsum(rng.normal(0, step, (n, 4)), axis=0) + [0, 0, 0, 1]
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def make_sequence(prefix, n_frames, fps=60, keyframe_interval=10, lost_gaps=(30, 300), lost_per_minute=2.0,
+                  keyframe_noise=0.004, seed=0, npy=False):
+    """Write synthetic PosInfo _Frame.txt and _keyFrame.txt files in the format of extract_mono_epic.
+
+    The camera moves as a random walk. Tracking is lost in gaps of lost_gaps[0] to lost_gaps[1]
+    frames, lost_per_minute times per minute of video on average, and at the start until the
+    map is initialized. Lost frames are written as extract_mono_epic does, with x == y == z == 0
+    and the identity rotation. A keyframe is taken every keyframe_interval tracked frames, its
+    position deviates from the frame by keyframe_noise, and by ten times that after a gap
+    until the map settles again. With npy, the _Frame.npy / _keyFrame.npy files are written too.
+    Returns the number of tracked frames.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(1, n_frames + 1) / float(fps)
+    pos = np.cumsum(rng.normal(0, 0.003, (n_frames, 3)), axis=0)
+    q = random_quaternions(n_frames, rng)
+
+    lost = np.zeros(n_frames, dtype=bool)
+    lost[:rng.integers(lost_gaps[0], lost_gaps[1] + 1)] = True
+    n_gaps = rng.poisson(lost_per_minute * n_frames / (60.0 * fps))
+    for start in rng.integers(0, n_frames, n_gaps):
+        lost[start:start + rng.integers(lost_gaps[0], lost_gaps[1] + 1)] = True
+    pos[lost] = 0
+    q[lost] = [0, 0, 0, 1]
+
+    tracked = np.flatnonzero(~lost)
+    keyframes = tracked[::keyframe_interval]
+    # frames shortly after a gap have not been refined by local BA yet
+    since_lost = np.arange(n_frames) - np.maximum.accumulate(np.where(lost, np.arange(n_frames), 0))
+    noise = np.where(since_lost[keyframes] < 5 * keyframe_interval, 10 * keyframe_noise, keyframe_noise)
+    key_pos = pos[keyframes] + rng.normal(0, 1, (len(keyframes), 3)) * noise[:, None]
+
+    frame_rows = np.column_stack([t, pos, q])
+    key_rows = np.column_stack([t[keyframes], key_pos, q[keyframes]])
+    for name, rows in [('Frame', frame_rows), ('keyFrame', key_rows)]:
+        np.savetxt('{}_{}.txt'.format(prefix, name), rows, fmt=['%.6f'] + ['%.7f'] * 7)
+        if npy:
+            np.save('{}_{}.npy'.format(prefix, name), np.loadtxt('{}_{}.txt'.format(prefix, name), ndmin=2))
+    return len(tracked)
+
+
+def make_action_labels(video_ids, num_frames, actions_per_minute=20, fps=60, seed=0):
+    """Synthetic EPIC action labels (video_id, start_frame, stop_frame, verb_class, noun_class)."""
+    rng = np.random.default_rng(seed)
+    labels = []
+    for video_id, n in zip(video_ids, num_frames):
+        n_actions = max(int(actions_per_minute * n / (60.0 * fps)), 1)
+        start = np.sort(rng.integers(0, n, n_actions))
+        labels.append(pd.DataFrame({'video_id': video_id, 'start_frame': start,
+                                    'stop_frame': start + rng.integers(fps, 10 * fps, n_actions),
+                                    'verb_class': rng.integers(0, 125, n_actions),
+                                    'noun_class': rng.integers(0, 352, n_actions)}))
+    return pd.concat(labels, ignore_index=True)
+
+
+def measure(fn, repeat=1, trace=True):
+    """Best wall time over repeat runs of fn() and the peak memory of one more, traced, run.
+
+    tracemalloc slows allocations down (several times for pandas I/O), so it is kept out of
+    the timed runs. Without trace the peak is reported as 0.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    if not trace:
+        return min(times), 0, result
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak, result
+
+
+def run_benchmarks(work_dir, n_frames, n_videos, fps, repeat, lost_gaps, lost_per_minute, seed=0, trace=True):
+    """Run every stage on synthetic data in work_dir, returns {stage: {seconds, frames, frames_per_sec, peak_mb}}."""
+    results = {}
+
+    def record(stage, frames, fn):
+        seconds, peak, result = measure(fn, repeat, trace)
+        results[stage] = {'seconds': seconds, 'frames': int(frames), 'frames_per_sec': frames / seconds,
+                          'peak_mb': peak / 2.0 ** 20}
+        print('{:<16} {:>9.3f} s {:>12.0f} frames/s {:>9.1f} MB peak'.format(stage, seconds, frames / seconds,
+                                                                             peak / 2.0 ** 20))
+        return result
+
+    prefix = os.path.join(work_dir, 'PosInfo_0_{}'.format(n_frames))
+    make_sequence(prefix, n_frames, fps, lost_gaps=lost_gaps, lost_per_minute=lost_per_minute, seed=seed, npy=True)
+    text_dir = os.path.join(work_dir, 'text')
+    os.makedirs(text_dir)
+    text_prefix = os.path.join(text_dir, 'PosInfo_0_{}'.format(n_frames))
+    for name in ['Frame', 'keyFrame']:
+        shutil.move('{}_{}.txt'.format(prefix, name), '{}_{}.txt'.format(text_prefix, name))
+
+    def quiet_extract(file_prefix, save_path):
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            return extract(5, 0.01, file_prefix, save_path)
+
+    record('extract_text', n_frames, lambda: quiet_extract(text_prefix, text_dir))
+    record('extract_npy', n_frames, lambda: quiet_extract(prefix, work_dir))
+
+    video_ids = ['P{:02d}_{:02d}'.format(1 + i // 10, 1 + i % 10) for i in range(n_videos)]
+    num_frames = pd.Series([n_frames] * n_videos, index=video_ids, name='num_frames')
+    labels = make_action_labels(video_ids, num_frames.values, fps=fps, seed=seed)
+    frame_action = record('make_fav', n_frames * n_videos, lambda: FrameAction.build(labels, num_frames))
+
+    valid_frame = pd.read_csv(os.path.join(work_dir, 'validFrame.csv'), index_col=0)
+    past_frames, future_frames = 2 * fps, 5 * fps
+
+    def window_loop():
+        starts = find_example_windows(valid_frame.index.values, past_frames + future_frames)
+        past_pos, future_pos = transform_windows(valid_frame[['x', 'y', 'z']].values,
+                                                 valid_frame[['q0', 'q1', 'q2', 'q3']].values,
+                                                 starts, past_frames, past_frames + future_frames)
+        start_frames = valid_frame.index.values[starts]
+        actions = [frame_action.actions(video_ids[0], s, s + future_frames) for s in start_frames.tolist()]
+        return start_frames, past_pos, future_pos, actions
+
+    start_frames, past_pos, future_pos, actions = record('example_windows', len(valid_frame), window_loop)
+
+    store_path = os.path.join(work_dir, 'EgoStore_bench')
+
+    def serialize():
+        store = EgoStoreWriter(store_path)
+        store.add_video(video_ids[0], os.path.join(work_dir, video_ids[0]), start_frames,
+                        np.arange(len(start_frames)), past_pos, future_pos, actions)
+        store.close()
+        frame_action.save(os.path.join(work_dir, 'frame_action.npz'))
+
+    record('serialize', len(valid_frame), serialize)
+
+    def load():
+        store = EgoStore(store_path)
+        for i in range(len(store)):
+            store[i]
+        FrameAction.load(os.path.join(work_dir, 'frame_action.npz'))
+
+    record('load', len(valid_frame), load)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every stage against baseline, returns the stages slower than 1 + tolerance times."""
+    regressions = []
+    print('\n{:<16} {:>10} {:>10} {:>8}'.format('stage', 'baseline', 'now', 'ratio'))
+    for stage, result in sorted(results.items()):
+        if stage not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[stage]['seconds']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+            flag = ' REGRESSION'
+        print('{:<16} {:>9.3f}s {:>9.3f}s {:>8.2f}{}'.format(stage, baseline[stage]['seconds'], result['seconds'],
+                                                            ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the trajectory to examples pipeline on synthetic data")
+    parser.add_argument("--frames", default=200000, type=int, help="frames of the synthetic sequence")
+    parser.add_argument("--videos", default=50, type=int, help="videos for the frame action vectors")
+    parser.add_argument("--fps", default=60, type=int)
+    parser.add_argument("--lost_gaps", default=[30, 300], type=int, nargs=2, help="min and max tracking lost frames")
+    parser.add_argument("--lost_per_minute", default=2.0, type=float, help="tracking lost gaps per minute")
+    parser.add_argument("--repeat", default=3, type=int, help="timed runs per stage, the fastest is reported")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--skip_memory", help="don't trace the peak memory of each stage", action="store_true")
+    parser.add_argument("--save_baseline", help="write the results to this json file")
+    parser.add_argument("--baseline", help="compare the results with this json file")
+    parser.add_argument("--tolerance", default=0.2, type=float, help="slowdown reported as a regression")
+    parser.add_argument("--work_dir", help="directory for the synthetic data (temporary by default)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark_pipeline_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmarks(work_dir, args.frames, args.videos, args.fps, args.repeat, tuple(args.lost_gaps),
+                                 args.lost_per_minute, args.seed, not args.skip_memory)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    config = {key: getattr(args, key) for key in ['frames', 'videos', 'fps', 'lost_gaps', 'lost_per_minute', 'seed']}
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'python': platform.python_version(), 'numpy': np.__version__,
+                       'pandas': pd.__version__, 'results': results}, f, indent=1, sort_keys=True)
+        print('Saved baseline to {}'.format(args.save_baseline))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != config:
+            print('Warning: baseline was measured with {}'.format(baseline['config']))
+        if compare(results, baseline['results'], args.tolerance):
+            sys.exit(1)
@@ -29,3 +29,9 @@ mkdir build
 cd build
 cmake .. -DCMAKE_BUILD_TYPE=Release
 make -j
+
+cd ..
+
+echo "Converting vocabulary to binary format ..."
+
+./tools/bin_vocabulary Vocabulary/ORBvoc.txt Vocabulary/ORBvoc.bin
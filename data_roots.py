@@ -0,0 +1,24 @@
+import os
+
+
+# EPIC_KITCHENS_2018 directory holding frames_rgb_flow/ and annotations/, the EPIC_ROOT environment variable overrides it
+EPIC_ROOT = os.environ.get('EPIC_ROOT', '/media/hdd1/guanjq/EPIC_KITCHENS_2018')
+
+
+def add_root_arguments(parser):
+    parser.add_argument("--epic_root", default=EPIC_ROOT,
+                        help="EPIC_KITCHENS_2018 directory (default: $EPIC_ROOT or %(default)s)")
+    parser.add_argument("--rgb_root", help="rgb frames, <epic_root>/frames_rgb_flow/rgb by default")
+    parser.add_argument("--flow_root", help="flow frames, <epic_root>/frames_rgb_flow/flow by default")
+    parser.add_argument("--annotations_root", help="annotations, <epic_root>/annotations by default")
+
+
+def resolve_roots(args):
+    """Fill in the roots that were not given on the command line from --epic_root."""
+    if args.rgb_root is None:
+        args.rgb_root = os.path.join(args.epic_root, 'frames_rgb_flow', 'rgb')
+    if args.flow_root is None:
+        args.flow_root = os.path.join(args.epic_root, 'frames_rgb_flow', 'flow')
+    if args.annotations_root is None:
+        args.annotations_root = os.path.join(args.epic_root, 'annotations')
+    return args
@@ -0,0 +1,164 @@
+import os
+import json
+import shutil
+import numpy as np
+from collections import namedtuple
+from frame_action import FrameActionSlice
+
+
+# Same fields as the arguments of EgoData
+EgoExample = namedtuple('EgoExample', ['past_pos', 'past_imgs', 'past_flow_u', 'past_flow_v', 'future_pos',
+                                       'future_actions', 'data_id', 'video_id', 'start_frame'])
+
+EXAMPLE_DTYPE = np.dtype([('video', np.int32), ('start_frame', np.int64), ('data_id', np.int64)])
+
+STORE_VERSION = 1
+
+
+def frame_paths(path, start, count):
+    """Paths of frame_{:010d}.jpg for count frames from start."""
+    names = np.char.mod('frame_%010d.jpg', np.arange(start, start + count))
+    return np.char.add(os.path.join(path, ''), names)
+
+
+def flow_path(video_path):
+    return video_path.replace('rgb/', 'flow/')
+
+
+class EgoStoreWriter(object):
+    """Collects the examples of one participant and writes them as an EgoStore directory.
+
+    Every array is a separate .npy file so that EgoStore can memory-map it:
+        videos, video_paths     video id and rgb frame directory of every video
+        examples                (video, start_frame, data_id) of every example
+        past_offsets, past_pos  past positions of example i are past_pos[past_offsets[i]:past_offsets[i + 1]]
+        future_offsets, future_pos
+        action_frame_offsets    future frames of example i are action_offsets[action_frame_offsets[i]:...[i + 1] + 1]
+        action_offsets, actions [verb, noun] pairs of those frames, as in FrameAction
+    Image and flow paths are not stored, they follow from the video path and the start frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.videos = []
+        self.video_paths = []
+        self.examples = []
+        self.past_pos = []
+        self.future_pos = []
+        self.action_frames = []
+        self.action_counts = []
+        self.actions = []
+
+    def add_video(self, video_id, video_path, start_frames, data_ids, past_pos, future_pos, future_actions):
+        """Add the examples of one video.
+
+        past_pos and future_pos are (examples, frames, 3) arrays and future_actions a list of
+        FrameActionSlice, one per example.
+        """
+        if len(start_frames) == 0:
+            return
+        examples = np.zeros(len(start_frames), dtype=EXAMPLE_DTYPE)
+        examples['video'] = len(self.videos)
+        examples['start_frame'] = start_frames
+        examples['data_id'] = data_ids
+        self.videos.append(video_id)
+        self.video_paths.append(video_path)
+        self.examples.append(examples)
+        self.past_pos.append(past_pos)
+        self.future_pos.append(future_pos)
+        for actions in future_actions:
+            offsets, pairs = actions.to_arrays()
+            self.action_frames.append(len(offsets) - 1)
+            self.action_counts.append(np.diff(offsets))
+            self.actions.append(pairs)
+
+    def add_store(self, store, first_data_id):
+        """Add all examples of an EgoStore, renumbered from first_data_id in their order in the store."""
+        for video, (video_id, video_path) in enumerate(zip(store.videos.tolist(), store.video_paths.tolist())):
+            rows = np.flatnonzero(store.examples['video'] == video)
+            if len(rows) == 0:
+                continue
+            first, last = rows[0], rows[-1] + 1
+            past_pos = np.asarray(store.past_pos[store.past_offsets[first]:store.past_offsets[last]])
+            future_pos = np.asarray(store.future_pos[store.future_offsets[first]:store.future_offsets[last]])
+            self.add_video(video_id, video_path, store.examples['start_frame'][rows], first_data_id + rows,
+                           past_pos.reshape(len(rows), -1, 3), future_pos.reshape(len(rows), -1, 3),
+                           [store.future_actions(i) for i in rows.tolist()])
+
+    def __len__(self):
+        return sum(len(examples) for examples in self.examples)
+
+    def close(self):
+        """Write the store, replacing any previous one at the same path."""
+        examples = np.concatenate(self.examples) if self.examples else np.zeros(0, dtype=EXAMPLE_DTYPE)
+        past_pos, past_offsets = _ragged(self.past_pos)
+        future_pos, future_offsets = _ragged(self.future_pos)
+        action_frame_offsets = np.concatenate([[0], np.cumsum(self.action_frames, dtype=np.int64)])
+        counts = np.concatenate(self.action_counts) if self.action_counts else np.zeros(0, dtype=np.int64)
+        action_offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        actions = np.concatenate(self.actions).astype(np.int32) if self.actions else np.zeros((0, 2), np.int32)
+
+        tmp_path = self.path + '.tmp'
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        arrays = dict(videos=np.array(self.videos, dtype=str), video_paths=np.array(self.video_paths, dtype=str),
+                      examples=examples, past_offsets=past_offsets, past_pos=past_pos,
+                      future_offsets=future_offsets, future_pos=future_pos,
+                      action_frame_offsets=action_frame_offsets, action_offsets=action_offsets, actions=actions)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'version': STORE_VERSION, 'examples': len(examples)}, f)
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.rename(tmp_path, self.path)
+
+
+def _ragged(arrays):
+    # (examples, frames, 3) blocks -> (total frames, 3) and per example offsets
+    if not arrays:
+        return np.zeros((0, 3)), np.zeros(1, dtype=np.int64)
+    lengths = np.concatenate([np.full(len(a), a.shape[1], dtype=np.int64) for a in arrays])
+    values = np.concatenate([a.reshape(-1, 3) for a in arrays])
+    return values, np.concatenate([[0], np.cumsum(lengths)])
+
+
+class EgoStore(object):
+    """Read-only, memory-mapped view of a directory written by EgoStoreWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            raise IOError('Unsupported EgoStore version {} in {}'.format(meta['version'], path))
+        for name in ['videos', 'video_paths', 'examples', 'past_offsets', 'past_pos', 'future_offsets', 'future_pos',
+                     'action_frame_offsets', 'action_offsets', 'actions']:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.examples)
+
+    def past_positions(self, i):
+        return self.past_pos[self.past_offsets[i]:self.past_offsets[i + 1]]
+
+    def future_positions(self, i):
+        return self.future_pos[self.future_offsets[i]:self.future_offsets[i + 1]]
+
+    def future_actions(self, i):
+        first, last = self.action_frame_offsets[i], self.action_frame_offsets[i + 1]
+        return FrameActionSlice(self.action_offsets[first:last + 1], self.actions)
+
+    def __getitem__(self, i):
+        video, start_frame, data_id = self.examples[i].tolist()
+        video_path = str(self.video_paths[video])
+        past_frames = int(self.past_offsets[i + 1] - self.past_offsets[i])
+        flow_start, flow_frames = int(start_frame / 2), int(past_frames / 2)
+        return EgoExample(past_pos=self.past_positions(i),
+                          past_imgs=frame_paths(video_path, start_frame, past_frames),
+                          past_flow_u=frame_paths(os.path.join(flow_path(video_path), 'u'), flow_start, flow_frames),
+                          past_flow_v=frame_paths(os.path.join(flow_path(video_path), 'v'), flow_start, flow_frames),
+                          future_pos=self.future_positions(i),
+                          future_actions=self.future_actions(i),
+                          data_id=data_id, video_id=str(self.videos[video]), start_frame=start_frame)
@@ -1,10 +1,18 @@
 import os
 import numpy as np
 import pandas as pd
-import dill
 import argparse
-from ego_data import EgoData
-from extract_valid_positions import extract
+from frame_action import FrameAction
+from ego_store import EgoStore, EgoStoreWriter, frame_paths, flow_path
+from extract_valid_positions import extract_cached, trajectory_exists
+from stage_cache import StageCache
+from video_index import VIDEO_INDEX_FILE, VideoIndex
+from data_roots import add_root_arguments, resolve_roots
+
+
+# seconds of trajectory before and after the start of the predicted actions
+EXAMPLE_PAST_TIME = 2
+EXAMPLE_FUTURE_TIME = 5
 
 
 def get_heading(q):
@@ -30,6 +38,76 @@ def toRotMatrix(q):
     R[2, 2] = 1 - 2 * q1 ** 2 - 2 * q2 ** 2
     return R
 
+
+def toRotMatrices(q):
+    """toRotMatrix of every row of q (N x 4, q0 first), as an N x 3 x 3 array."""
+    q0, q1, q2, q3 = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    R = np.empty([len(q), 3, 3])
+    R[:, 0, 0] = 1 - 2 * q2 ** 2 - 2 * q3 ** 2
+    R[:, 0, 1] = 2 * q1 * q2 + 2 * q0 * q3
+    R[:, 0, 2] = 2 * q1 * q3 - 2 * q0 * q2
+    R[:, 1, 0] = 2 * q1 * q2 - 2 * q0 * q3
+    R[:, 1, 1] = 1 - 2 * q1 ** 2 - 2 * q3 ** 2
+    R[:, 1, 2] = 2 * q2 * q3 + 2 * q0 * q1
+    R[:, 2, 0] = 2 * q1 * q3 + 2 * q0 * q2
+    R[:, 2, 1] = 2 * q2 * q3 - 2 * q0 * q1
+    R[:, 2, 2] = 1 - 2 * q1 ** 2 - 2 * q2 ** 2
+    return R
+
+
+def find_example_windows(frame_index, example_frames):
+    """Row positions where examples of example_frames consecutive frames start.
+
+    Same windows as a greedy left to right scan that takes a window whenever the next
+    example_frames frames are consecutive and then jumps past it: within each run of
+    consecutive frames, windows start at the run start and every example_frames frames.
+    """
+    if len(frame_index) < example_frames:
+        return np.zeros(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(frame_index) != 1) + 1
+    run_start = np.concatenate([[0], breaks])
+    run_length = np.diff(np.concatenate([run_start, [len(frame_index)]]))
+    n_windows = run_length // example_frames
+    offsets = np.arange(n_windows.sum()) - np.repeat(np.cumsum(n_windows) - n_windows, n_windows)
+    return np.repeat(run_start, n_windows) + offsets * example_frames
+
+
+def transform_windows(positions, quaternions, starts, past_frames, example_frames):
+    """Past and future positions of every window in the frame of its last past position.
+
+    positions are x y z and quaternions q0 q1 q2 q3 (TUM order, w last) rows of the valid frames.
+    Returns arrays of shape (windows, past_frames, 3) and (windows, example_frames - past_frames, 3).
+    """
+    rows = starts[:, None] + np.arange(example_frames)
+    pos = positions[rows]
+    q = quaternions[starts + past_frames - 1]
+    R = toRotMatrices(np.hstack([q[:, 3:], q[:, 0:3]]))
+    t = pos[:, past_frames - 1:past_frames]
+    local = np.matmul(np.transpose(R, (0, 2, 1))[:, None], np.expand_dims(pos - t, -1))[..., 0]
+    return local[:, :past_frames], local[:, past_frames:]
+
+
+def video_examples(valid_frame, video_id, ori_fps, frame_action, past_time=EXAMPLE_PAST_TIME,
+                   future_time=EXAMPLE_FUTURE_TIME):
+    """Examples of one video from its validFrame.csv table.
+
+    Returns the start frames, past and future positions (see transform_windows) and the
+    FrameActionSlice of the future frames of every example.
+    """
+    example_past_frames = past_time * ori_fps
+    example_future_frames = future_time * ori_fps
+    example_frames = (past_time + future_time) * ori_fps
+    # consecutive windows of example_frames valid frames, transformed into the frame of their last past position
+    starts = find_example_windows(valid_frame.index.values, example_frames)
+    past_pos_all, future_pos_all = transform_windows(valid_frame[['x', 'y', 'z']].values,
+                                                     valid_frame[['q0', 'q1', 'q2', 'q3']].values,
+                                                     starts, example_past_frames, example_frames)
+    start_frames = valid_frame.index.values[starts]
+    future_actions = [frame_action.actions(video_id, s_idx, s_idx + example_future_frames)
+                      for s_idx in start_frames.tolist()]
+    return start_frames, past_pos_all, future_pos_all, future_actions
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_split", help="train or test")
@@ -37,41 +115,36 @@ if __name__ == '__main__':
     # parser.add_argument("--sub_data_id", default="R", help="XX")
     parser.add_argument("--make_fav", help="make frame action vector", action="store_true")
     parser.add_argument("--save_root", help="save root path")
-    args = parser.parse_args()
-
-    annotations_root = '/media/hdd1/guanjq/EPIC_KITCHENS_2018/annotations/'
-    fav_save_path = os.path.join(args.save_root, "frame_action")
+    parser.add_argument("--save_dill", help="also save the dill pickled EgoData list of each participant",
+                        action="store_true")
+    parser.add_argument("--no_cache", help="recompute valid frames and examples even if their inputs are unchanged",
+                        action="store_true")
+    parser.add_argument("--chunk_size", type=int,
+                        help="read text trajectories in chunks of this many frames to bound memory on long videos")
+    add_root_arguments(parser)
+    args = resolve_roots(parser.parse_args())
+    if args.save_dill:
+        import dill
+        from ego_data import EgoData
+
+    annotations_root = args.annotations_root
+    fav_save_path = os.path.join(args.save_root, "frame_action.npz")
 
     if args.make_fav:
         print('Making frame action vectors ...')
         df = pd.read_pickle(os.path.join(annotations_root, 'EPIC_train_action_labels.pkl'))
         video_info = pd.read_csv(os.path.join(annotations_root, 'video_frames_info.csv'), index_col=0)
 
-        frame_action = pd.DataFrame(columns=['action'])
-        for video_id in video_info.index:
-            frame_action.loc[video_id] = [[[[-1, -1]]] * video_info.loc[video_id, 'num_frames']]
-
         # construct frame action vectors
-        for idx, row in df.iterrows():
-            vec = frame_action.loc[row.video_id].action
-            verb = row.verb_class
-            noun = row.noun_class
-            for frame_idx in range(row.start_frame, row.stop_frame + 1):
-                frame_vec = vec[frame_idx]
-                if [-1, -1] == frame_vec[0]:
-                    frame_vec = [[verb, noun]]
-                else:
-                    frame_vec.append([verb, noun])
-                vec[frame_idx] = frame_vec
-
-        with open(fav_save_path, "wb") as f:
-            dill.dump(frame_action, f)
+        frame_action = FrameAction.build(df, video_info.num_frames)
+        frame_action.save(fav_save_path)
 
     else:
-        frame_action = dill.load(open(fav_save_path, "rb"))
+        frame_action = FrameAction.load(fav_save_path)
 
-    all_fps = pd.read_csv(os.path.join(annotations_root, 'EPIC_video_info.csv'))
-    data_root_path = '/media/hdd1/guanjq/EPIC_KITCHENS_2018/frames_rgb_flow/rgb/'
+    data_root_path = args.rgb_root
+    video_index = VideoIndex(os.path.join(data_root_path, args.data_split, VIDEO_INDEX_FILE),
+                             os.path.join(annotations_root, 'EPIC_video_info.csv'))
 
     if args.data_id == 'A':
         data_id_list = [f for f in os.listdir(os.path.join(data_root_path, args.data_split)) if f.startswith('P')]
@@ -83,18 +156,21 @@ if __name__ == '__main__':
     # parameters to be adjusted
     n_frame = 5
     threshold = 0.01
-    example_past_time = 2
-    example_future_time = 5
-    example_time = example_past_time + example_future_time
+    example_past_time = EXAMPLE_PAST_TIME
+    example_future_time = EXAMPLE_FUTURE_TIME
+
+    # examples of a participant are only rebuilt when a valid frame file, the frame action
+    # vectors or the example settings changed
+    cache = StageCache(os.path.join(args.save_root, 'cache.json'), enabled=not args.no_cache)
 
     total_examples = 0
     for data_idx, data_id in enumerate(data_id_list):
         print('\n{} {} of {}'.format(data_id, data_idx + 1, len(data_id_list)))
-        example_list = []
         data_path = os.path.join(data_root_path, args.data_split, data_id)
         sub_id_list = [f for f in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, f))]
         sub_id_list.sort()
 
+        videos = []
         for sub_idx, sub_id in enumerate(sub_id_list):
             print('\n{} {} of {}'.format(sub_id, sub_idx + 1, len(sub_id_list)))
             sub_data_path = os.path.join(data_path, sub_id)
@@ -106,98 +182,69 @@ if __name__ == '__main__':
 
             # num_frames  = len([f for f in os.listdir(sub_data_path) if f.endswith('.jpg')])
             num_frames = int([f for f in os.listdir(metadata_dir) if f.startswith('rgb')][0][6:-4])
-            if len(all_fps.loc[all_fps.video == sub_id, 'fps']) == 0:
-                ori_fps = 60
-            else:
-                ori_fps = int(round(all_fps.loc[all_fps.video == sub_id, 'fps'].values[0]))
+            ori_fps = video_index.fps(sub_id)
 
-            example_past_frames = example_past_time * ori_fps
-            example_future_frames = example_future_time * ori_fps
-            example_frames = example_time * ori_fps
             print('Number of frames: {} \t fps: {}'.format(num_frames, ori_fps))
 
             file_prefix = os.path.join(metadata_dir, 'PosInfo_0_%d' % num_frames)  # prefix of Frame txt and keyFrame txt
-            if not os.path.exists(file_prefix + '_Frame.txt'):
-                print('{} not exists!'.format(file_prefix + '_Frame.txt'))
+            if not trajectory_exists(file_prefix):
+                print('{} not exists!'.format(file_prefix + '_Frame.txt/.npy'))
                 continue
 
             # extract valid positions
-            if os.path.exists(os.path.join(metadata_dir, 'validFrame.csv')):
-                print('valid frame file exists!')
-            else:
-                print('extract valid frame ...')
-                extract(n_frame, threshold, file_prefix, metadata_dir)
-            valid_frame = pd.read_csv(os.path.join(metadata_dir, 'validFrame.csv'), index_col=0)
+            extract_cached(n_frame, threshold, file_prefix, metadata_dir,
+                           StageCache(os.path.join(metadata_dir, 'cache.json'), enabled=not args.no_cache),
+                           args.chunk_size)
+            videos.append((sub_id, sub_data_path, os.path.join(metadata_dir, 'validFrame.csv'), ori_fps))
+
+        store_path = os.path.join(args.save_root, "EgoStore_{}".format(data_id))
+        dill_path = os.path.join(args.save_root, "EgoData_{}".format(data_id))
+        inputs = [fav_save_path] + [valid_path for _, _, valid_path, _ in videos]
+        params = dict(videos=[(sub_id, ori_fps) for sub_id, _, _, ori_fps in videos], first_data_id=total_examples,
+                      past_time=example_past_time, future_time=example_future_time)
+        outputs = [store_path] + ([dill_path] if args.save_dill else [])
+        if cache.fresh(data_id, inputs, params, outputs):
+            total_examples += len(EgoStore(store_path))
+            print('Examples are up to date: {}'.format(store_path))
+            print('Total examples: ', total_examples)
+            continue
+
+        example_list = []
+        store = EgoStoreWriter(store_path)
+        for sub_id, sub_data_path, valid_path, ori_fps in videos:
+            example_past_frames = example_past_time * ori_fps
+            valid_frame = pd.read_csv(valid_path, index_col=0)
 
             # consider tracking lost!
             n_examples = 0
             if len(valid_frame) == 0:
-                print('The number of examples: ', n_examples)
+                print('The number of examples of {}: '.format(sub_id), n_examples)
                 continue
-            idx = 0
-            s_idx = valid_frame.index[0]
-
-            while s_idx <= valid_frame.index[-1] - example_frames + 1 and idx + example_frames - 1 < len(valid_frame):
-                if s_idx + example_frames - 1 != valid_frame.index[idx + example_frames - 1]:
-                    idx += 1
-                    s_idx = valid_frame.index[idx]
-                    continue
-                else:
-                    # example_df = valid_frame.loc[s_idx: s_idx + example_frames - 1]
-                    # past_pos = example_df.iloc[0: example_past_frames, 1:4].values
-                    # future_pos = example_df.iloc[example_past_frames:, 1:4].values
-
-                    if valid_frame.index[idx] >= 0:
-                        example_df = valid_frame.loc[s_idx: s_idx + example_frames - 1]
-                        qwo = example_df.iloc[example_past_frames - 1, 4:].values
-                        qwo = np.hstack([qwo[3], qwo[0:3]])
-
-                        # Transformation 1:
-                        # heading = get_heading(qwo)
-                        # Rwo = toRotMatrix(heading)
-                        # two = np.expand_dims(example_df.iloc[example_past_frames, 1:4].values, 1)
-                        # Row = Rwo.T
-                        # tow = np.matmul(-Rwo.T, two)
-                        # assert tow.shape == (3, 1)
-                        # past_pos_ori = example_df.iloc[0: example_past_frames, 1:4].values
-                        # future_pos_ori = example_df.iloc[example_past_frames:, 1:4].values
-                        # past_pos = (np.matmul(Row, np.expand_dims(past_pos_ori, -1)) + tow)[..., 0]
-                        # future_pos = (np.matmul(Row, np.expand_dims(future_pos_ori, -1)) + tow)[..., 0]
-
-                        # Transformation 2:
-                        R = toRotMatrix(qwo)
-                        t = example_df.iloc[example_past_frames - 1, 1:4].values
-                        past_pos_ori = example_df.iloc[0: example_past_frames, 1:4].values
-                        future_pos_ori = example_df.iloc[example_past_frames:, 1:4].values
-                        past_pos = np.matmul(R.T, np.expand_dims(past_pos_ori - t, -1))[..., 0]
-                        future_pos = np.matmul(R.T, np.expand_dims(future_pos_ori - t, -1))[..., 0]
-
-                        past_imgs = np.array([os.path.join(sub_data_path, 'frame_{:010d}.jpg'.format(img_idx))
-                                              for img_idx in range(s_idx, s_idx + example_past_frames)])
-                        past_flow_u = np.array([os.path.join(sub_data_path.replace('rgb/', 'flow/'), 'u', 'frame_{:010d}.jpg'.format(img_idx))
-                                                for img_idx in range(int(s_idx / 2), int(s_idx / 2) + int(example_past_frames / 2))])
-                        past_flow_v = np.array([os.path.join(sub_data_path.replace('rgb/', 'flow/'), 'v', 'frame_{:010d}.jpg'.format(img_idx))
-                                                for img_idx in range(int(s_idx / 2), int(s_idx / 2) + int(example_past_frames / 2))])
-
-                        future_actions = frame_action.loc[sub_id, 'action'][s_idx: s_idx + example_future_frames]
-                        example = EgoData(past_pos, past_imgs, past_flow_u, past_flow_v, future_pos, future_actions,
-                                          data_id=total_examples + n_examples, video_id=sub_id, start_frame=s_idx)
-                        example_list.append(example)
-                        n_examples += 1
-
-                    idx += example_frames
-                    s_idx = valid_frame.index[idx]
-
-                    # print('past pos: ', past_pos.shape)
-                    # print('future pos: ', future_pos.shape)
-                    # print('past img: ', len(past_imgs))
-                    # print('future actions: ', len(future_actions))
+            start_frames, past_pos_all, future_pos_all, future_actions = video_examples(
+                valid_frame, sub_id, ori_fps, frame_action, example_past_time, example_future_time)
+            n_examples = len(start_frames)
+            store.add_video(sub_id, sub_data_path, start_frames, total_examples + np.arange(n_examples),
+                            past_pos_all, future_pos_all, future_actions)
+
+            if args.save_dill:
+                for n, s_idx in enumerate(start_frames.tolist()):
+                    past_imgs = frame_paths(sub_data_path, s_idx, example_past_frames)
+                    past_flow_u = frame_paths(os.path.join(flow_path(sub_data_path), 'u'), int(s_idx / 2),
+                                              int(example_past_frames / 2))
+                    past_flow_v = frame_paths(os.path.join(flow_path(sub_data_path), 'v'), int(s_idx / 2),
+                                              int(example_past_frames / 2))
+                    example = EgoData(past_pos_all[n], past_imgs, past_flow_u, past_flow_v, future_pos_all[n],
+                                      future_actions[n].tolist(), data_id=total_examples + n, video_id=sub_id,
+                                      start_frame=s_idx)
+                    example_list.append(example)
 
             total_examples += n_examples
-            print('The number of examples: ', n_examples)
+            print('The number of examples of {}: '.format(sub_id), n_examples)
 
         print('Total examples: ', total_examples)
-        save_path = os.path.join(args.save_root, "EgoData_{}".format(data_id))
-        with open(save_path, "wb") as dill_file:
-            dill.dump(example_list, dill_file)
+        store.close()
+        if args.save_dill:
+            with open(dill_path, "wb") as dill_file:
+                dill.dump(example_list, dill_file)
+        cache.update(data_id, inputs, params, outputs)
 
@@ -25,37 +25,210 @@
 #include<algorithm>
 #include<fstream>
 #include<chrono>
+#include<cstdlib>
+#include<map>
 
 #include<opencv2/core/core.hpp>
 
 #include<System.h>
 #include<Converter.h>
+#include<ImagePrefetcher.h>
 
 using namespace std;
 
 void LoadImages(const string &strFile, vector<string> &vstrImageFilenames,
                 vector<double> &vTimestamps);
 
+// Frame pacing of the tracking loop
+struct Pacing
+{
+    string mode;
+    double fixed_period;
+};
+
+bool ParsePacing(const string &strPacing, Pacing &pacing);
+
+// Tracks all images of a sequence, storing the pose of every frame in all_T. Returns 0 on success.
+// One line per frame is written to strTelemetryFile (csv, see TELEMETRY_HEADER) unless it is empty.
+int TrackSequence(ORB_SLAM2::System &SLAM, ORB_SLAM2::ImagePrefetcher &prefetcher, const vector<string> &vstrImageFilenames,
+                  const vector<double> &vTimestamps, const Pacing &pacing, vector<cv::Mat> &all_T,
+                  const string &strTelemetryFile);
+
+// Per frame telemetry: tracking state, wall times in seconds (tracking, waiting for the image, waiting
+// because of the pacing), keyframes and map points in the map, map points tracked in the frame and
+// keyframes queued for Local Mapping and Loop Closing after the frame was tracked.
+const char *TELEMETRY_HEADER = "frame,timestamp,state,track_time,image_wait,pacing_wait,keyframes,map_points,"
+                               "tracked_points,local_mapping_queue,loop_closing_queue";
+
+// Writes the _keyFrame.txt, _Frame.txt, _mapPoint.txt and _refMapPoint.txt files of a sequence.
+void SaveSequence(ORB_SLAM2::System &SLAM, const string &prefix, const vector<double> &vTimestamps, const vector<cv::Mat> &all_T);
+
+// Writes the same information as .npy files that numpy can memory-map:
+// _Frame.npy and _keyFrame.npy (float64, t x y z q0 q1 q2 q3 per row), _mapPoint.npy (float32, x y z per row),
+// and for keyframe i of _keyFrame.npy the rows _refMapPointIndex.npy[_refMapPointOffsets.npy[i]:_refMapPointOffsets.npy[i+1]]
+// of _mapPoint.npy it references, instead of repeating the points under every keyframe.
+void SaveSequenceNpy(ORB_SLAM2::System &SLAM, const string &prefix, const vector<double> &vTimestamps, const vector<cv::Mat> &all_T);
+
+// Writes a little-endian .npy file (format version 1.0)
+void SaveNpy(const string &filename, const string &descr, const vector<size_t> &shape, const void *data, size_t nbytes);
+
 int main(int argc, char **argv)
 {
-    if(argc != 6)
+    if(argc < 6 || argc > 8)
     {
-        cerr << endl << "Usage: ./mono_epic path_to_vocabulary path_to_settings path_to_sequence path_to_save (use_viewer)" << endl;
+        cerr << endl << "Usage: ./mono_epic path_to_vocabulary path_to_settings path_to_sequence path_to_save (use_viewer) [pacing] [output]" << endl;
+        cerr << "       ./mono_epic path_to_vocabulary path_to_settings --jobs path_to_manifest|- (use_viewer) [pacing] [output]" << endl;
+        cerr << "pacing: realtime (timestamp deltas), fixed[:seconds] (default fixed:0.3) or fast (wait for Local Mapping only)" << endl;
+        cerr << "output: text (default), npy or both" << endl;
+        cerr << "manifest: one 'path_to_sequence path_to_save' job per line, '-' reads the jobs from stdin" << endl;
+        cerr << "sequence: one 'timestamp image' per line, image is a file or archive.tar@offset:size for a JPEG inside an uncompressed tar" << endl;
+        cerr << "per frame telemetry is written to path_to_save_telemetry.csv" << endl;
         return 1;
     }
 
-    // Retrieve paths to images
-    vector<string> vstrImageFilenames;
-    vector<double> vTimestamps;
-    string strFile = string(argv[3]);
+    Pacing pacing;
+    if(!ParsePacing((argc >= 7) ? string(argv[6]) : "fixed", pacing))
+        return 1;
+
+    string output = (argc == 8) ? string(argv[7]) : "text";
+    if(output != "text" && output != "npy" && output != "both")
+    {
+        cerr << endl << "Unknown output: " << output << endl;
+        return 1;
+    }
+    bool bSaveText = (output != "npy");
+    bool bSaveNpy = (output != "text");
+
     bool use_viewer = (string(argv[5]) == "1");
-    LoadImages(strFile, vstrImageFilenames, vTimestamps);
+    bool bJobs = (string(argv[3]) == "--jobs");
 
-    int nImages = vstrImageFilenames.size();
+    cv::FileStorage fsSettings(argv[2], cv::FileStorage::READ);
+    int nQueueDepth = fsSettings["Prefetch.queueDepth"].empty() ? 16 : (int)fsSettings["Prefetch.queueDepth"];
+    int nLoaderThreads = fsSettings["Prefetch.nThreads"].empty() ? 2 : (int)fsSettings["Prefetch.nThreads"];
+
+    if(!bJobs)
+    {
+        // Retrieve paths to images
+        vector<string> vstrImageFilenames;
+        vector<double> vTimestamps;
+        string strFile = string(argv[3]);
+        LoadImages(strFile, vstrImageFilenames, vTimestamps);
+
+        // Start decoding images while the vocabulary is loaded
+        ORB_SLAM2::ImagePrefetcher prefetcher(vstrImageFilenames,CV_LOAD_IMAGE_UNCHANGED,nQueueDepth,nLoaderThreads);
+
+        // Create SLAM system. It initializes all system threads and gets ready to process frames.
+        ORB_SLAM2::System SLAM(argv[1],argv[2],ORB_SLAM2::System::MONOCULAR,use_viewer);
+
+        vector<cv::Mat> all_T;
+        if(TrackSequence(SLAM, prefetcher, vstrImageFilenames, vTimestamps, pacing, all_T,
+                         string(argv[4]) + "_telemetry.csv") != 0)
+            return 1;
+
+        // Stop all threads
+        SLAM.Shutdown();
+
+        if(bSaveText)
+            SaveSequence(SLAM, string(argv[4]), vTimestamps, all_T);
+        if(bSaveNpy)
+            SaveSequenceNpy(SLAM, string(argv[4]), vTimestamps, all_T);
+        return 0;
+    }
+
+    // Persistent mode: one SLAM system for a queue of sequences, the map is reset between them
+    ifstream fManifest;
+    string strManifest = string(argv[4]);
+    if(strManifest != "-")
+    {
+        fManifest.open(strManifest.c_str());
+        if(!fManifest.is_open())
+        {
+            cerr << endl << "Failed to open jobs manifest: " << strManifest << endl;
+            return 1;
+        }
+    }
+    istream &jobs = (strManifest == "-") ? cin : fManifest;
 
-    // Create SLAM system. It initializes all system threads and gets ready to process frames.
     ORB_SLAM2::System SLAM(argv[1],argv[2],ORB_SLAM2::System::MONOCULAR,use_viewer);
 
+    int nJobs = 0;
+    int nFailed = 0;
+    string line;
+    while(getline(jobs, line))
+    {
+        stringstream ss(line);
+        string strFile, prefix;
+        ss >> strFile >> prefix;
+        if(strFile.empty())
+            continue;
+
+        int status = 1;
+        if(prefix.empty())
+            cerr << endl << "Wrong job (expected 'path_to_sequence path_to_save'): " << line << endl;
+        else
+        {
+            cout << endl << "Start job: " << strFile << " -> " << prefix << endl;
+            vector<string> vstrImageFilenames;
+            vector<double> vTimestamps;
+            LoadImages(strFile, vstrImageFilenames, vTimestamps);
+
+            ORB_SLAM2::ImagePrefetcher prefetcher(vstrImageFilenames,CV_LOAD_IMAGE_UNCHANGED,nQueueDepth,nLoaderThreads);
+            vector<cv::Mat> all_T;
+            status = TrackSequence(SLAM, prefetcher, vstrImageFilenames, vTimestamps, pacing, all_T,
+                                   prefix + "_telemetry.csv");
+            if(status == 0)
+            {
+                // Let Local Mapping and Loop Closing finish with this sequence before reading the map
+                SLAM.WaitForMapping();
+                if(bSaveText)
+                    SaveSequence(SLAM, prefix, vTimestamps, all_T);
+                if(bSaveNpy)
+                    SaveSequenceNpy(SLAM, prefix, vTimestamps, all_T);
+            }
+
+            // The map is cleared when the next sequence passes its first frame
+            SLAM.Reset();
+        }
+
+        nJobs++;
+        if(status != 0)
+            nFailed++;
+        cout << "Finished job: " << prefix << " status: " << status << endl;
+    }
+
+    SLAM.Shutdown();
+    cout << endl << "Processed " << nJobs << " jobs, " << nFailed << " failed." << endl;
+    return nFailed == 0 ? 0 : 1;
+}
+
+bool ParsePacing(const string &strPacing, Pacing &pacing)
+{
+    pacing.mode = strPacing;
+    pacing.fixed_period = 0.3;
+    if(pacing.mode.compare(0, 6, "fixed:") == 0)
+    {
+        pacing.fixed_period = atof(pacing.mode.substr(6).c_str());
+        pacing.mode = "fixed";
+    }
+    if(pacing.mode != "realtime" && pacing.mode != "fixed" && pacing.mode != "fast")
+    {
+        cerr << endl << "Unknown pacing: " << strPacing << endl;
+        return false;
+    }
+    return true;
+}
+
+int TrackSequence(ORB_SLAM2::System &SLAM, ORB_SLAM2::ImagePrefetcher &prefetcher, const vector<string> &vstrImageFilenames,
+                  const vector<double> &vTimestamps, const Pacing &pacing, vector<cv::Mat> &all_T,
+                  const string &strTelemetryFile)
+{
+    int nImages = vstrImageFilenames.size();
+    if(nImages == 0)
+    {
+        cerr << endl << "No images in the sequence!" << endl;
+        return 1;
+    }
+
     // Vector for tracking time statistics
     vector<float> vTimesTrack;
     vTimesTrack.resize(nImages);
@@ -64,21 +237,29 @@ int main(int argc, char **argv)
     cout << "Start processing sequence ..." << endl;
     cout << "Images in the sequence: " << nImages << endl << endl;
 
-    vector<cv::Mat> all_T;
+    ofstream fTelemetry;
+    if(!strTelemetryFile.empty())
+    {
+        fTelemetry.open(strTelemetryFile.c_str());
+        fTelemetry << fixed << TELEMETRY_HEADER << endl;
+    }
+    ORB_SLAM2::Map* pMap = SLAM.get_map();
+
     // Main loop
     cv::Mat im;
     int state;
     int last_state = 1;
-    // Record time
-    clock_t begin_time = clock();
-    clock_t end_time = clock();
-    clock_t total_begin_time = clock();
+    // Record wall time, clock() would add up the CPU time of all SLAM threads
+    std::chrono::steady_clock::time_point begin_time = std::chrono::steady_clock::now();
+    std::chrono::steady_clock::time_point total_begin_time = begin_time;
 
     for(int ni=0; ni<nImages; ni++)
     {   
-        // Read image from file
-        im = cv::imread(vstrImageFilenames[ni],CV_LOAD_IMAGE_UNCHANGED);
+        // Read image from the prefetch queue
+        std::chrono::steady_clock::time_point t0 = std::chrono::steady_clock::now();
+        im = prefetcher.Get(ni);
         double tframe = vTimestamps[ni];
+        double twait = std::chrono::duration_cast<std::chrono::duration<double> >(std::chrono::steady_clock::now() - t0).count();
 
         if(im.empty())
         {
@@ -121,10 +302,10 @@ int main(int argc, char **argv)
 
         if ((ni + 1) % 100 == 0)
         {
-            end_time = clock();
-            cout << "Image: " << setw(6) << ni + 1 << " Tracking state: " << state << " Tracking time: " << double(end_time - begin_time) / CLOCKS_PER_SEC << endl;
-            begin_time = clock();
-
+            std::chrono::steady_clock::time_point end_time = std::chrono::steady_clock::now();
+            cout << "Image: " << setw(6) << ni + 1 << " Tracking state: " << state << " Tracking time: "
+                 << std::chrono::duration_cast<std::chrono::duration<double> >(end_time - begin_time).count() << endl;
+            begin_time = end_time;
         }
         // Save camera position
         all_T.push_back(Tcw);
@@ -140,24 +321,52 @@ int main(int argc, char **argv)
 
         vTimesTrack[ni]=ttrack;
 
+        // Queue depths right after tracking, before the pacing lets the other threads catch up
+        int nLocalMappingQueue = SLAM.LocalMappingQueueSize();
+        int nLoopClosingQueue = SLAM.LoopClosingQueueSize();
+
         // Wait to load the next frame
-        double T=0;
-        if(ni<nImages-1)
-            T = vTimestamps[ni+1]-tframe;
-        else if(ni>0)
-            T = tframe-vTimestamps[ni-1];
-
-        // if(ttrack<T)
-        //     usleep((T-ttrack)*1e6);
-        if(ttrack<0.3)
-            usleep((0.3 - ttrack)*1e6);
-    }
+        if(pacing.mode == "realtime")
+        {
+            double T=0;
+            if(ni<nImages-1)
+                T = vTimestamps[ni+1]-tframe;
+            else if(ni>0)
+                T = tframe-vTimestamps[ni-1];
+
+            if(ttrack<T)
+                usleep((T-ttrack)*1e6);
+        }
+        else if(pacing.mode == "fixed")
+        {
+            if(ttrack<pacing.fixed_period)
+                usleep((pacing.fixed_period - ttrack)*1e6);
+        }
+        else
+        {
+            // Backpressure: let Local Mapping catch up so that new keyframes are not refused
+            while(!SLAM.LocalMappingIdle())
+                usleep(1000);
+        }
 
-    // Stop all threads
-    SLAM.Shutdown();
+        if(fTelemetry.is_open())
+        {
+            double tpacing = std::chrono::duration_cast<std::chrono::duration<double> >(std::chrono::steady_clock::now() - t2).count();
+            const vector<ORB_SLAM2::MapPoint*> vpTracked = SLAM.GetTrackedMapPoints();
+            int nTracked = 0;
+            for(size_t i=0; i<vpTracked.size(); i++)
+                if(vpTracked[i])
+                    nTracked++;
+            fTelemetry << ni << "," << setprecision(6) << tframe << "," << state << "," << setprecision(6) << ttrack
+                       << "," << twait << "," << tpacing << "," << pMap->KeyFramesInMap() << "," << pMap->MapPointsInMap()
+                       << "," << nTracked << "," << nLocalMappingQueue << "," << nLoopClosingQueue << "\n";
+        }
+    }
+    if(fTelemetry.is_open())
+        fTelemetry.close();
 
-    clock_t total_end_time = clock();
-    cout << "Total used time: " << double(total_end_time - total_begin_time) / CLOCKS_PER_SEC << endl;
+    std::chrono::steady_clock::time_point total_end_time = std::chrono::steady_clock::now();
+    cout << "Total used time: " << std::chrono::duration_cast<std::chrono::duration<double> >(total_end_time - total_begin_time).count() << endl;
     // Tracking time statistics
     sort(vTimesTrack.begin(),vTimesTrack.end());
     float totaltime = 0;
@@ -168,9 +377,15 @@ int main(int argc, char **argv)
     cout << "-------" << endl << endl;
     cout << "median tracking time: " << vTimesTrack[nImages/2] << endl;
     cout << "mean tracking time: " << totaltime/nImages << endl;
+    cout << "image queue stall time: " << prefetcher.GetStallTime() << " (mean " << prefetcher.GetStallTime()/nImages << ")" << endl;
+    return 0;
+}
+
+void SaveSequence(ORB_SLAM2::System &SLAM, const string &prefix, const vector<double> &vTimestamps, const vector<cv::Mat> &all_T)
+{
+    int nImages = all_T.size();
 
     // Save camera trajectory
-    string prefix = string(argv[4]);
     SLAM.SaveKeyFrameTrajectoryTUM(prefix + "_keyFrame.txt");
     
     string filename = prefix + "_Frame.txt";
@@ -241,7 +456,121 @@ int main(int argc, char **argv)
     }
     rf.close();
     cout << endl << "reference map points saved!" << endl;
-    return 0;
+}
+
+void SaveSequenceNpy(ORB_SLAM2::System &SLAM, const string &prefix, const vector<double> &vTimestamps, const vector<cv::Mat> &all_T)
+{
+    cout << endl << "Saving binary trajectory and map points to " << prefix << "_*.npy ..." << endl;
+
+    // Frames
+    size_t nImages = all_T.size();
+    vector<double> vFrames;
+    vFrames.reserve(nImages*8);
+    for(size_t ni = 0; ni < nImages; ni++)
+    {
+        cv::Mat Tcw = all_T[ni];
+        if(Tcw.empty())
+        {
+            Tcw = cv::Mat::eye(4,4,CV_32F);
+        }
+        cv::Mat R = Tcw.rowRange(0,3).colRange(0,3).t();
+        vector<float> q = ORB_SLAM2::Converter::toQuaternion(R);
+        cv::Mat t = -R * Tcw.rowRange(0,3).col(3);
+        double row[8] = {vTimestamps[ni], t.at<float>(0), t.at<float>(1), t.at<float>(2), q[0], q[1], q[2], q[3]};
+        vFrames.insert(vFrames.end(), row, row+8);
+    }
+
+    // Map points, each stored once
+    ORB_SLAM2::Map* mpMap = SLAM.get_map();
+    const vector<ORB_SLAM2::MapPoint*> &vpMPs = mpMap->GetAllMapPoints();
+    map<ORB_SLAM2::MapPoint*, int> mPointIndex;
+    vector<float> vPoints;
+    for(size_t i=0, iend=vpMPs.size(); i<iend; i++)
+    {
+        if(vpMPs[i]->isBad())
+            continue;
+        cv::Mat pos = vpMPs[i]->GetWorldPos();
+        mPointIndex[vpMPs[i]] = vPoints.size()/3;
+        vPoints.push_back(pos.at<float>(0));
+        vPoints.push_back(pos.at<float>(1));
+        vPoints.push_back(pos.at<float>(2));
+    }
+
+    // Keyframes and the indices of the map points they reference
+    vector<ORB_SLAM2::KeyFrame*> vpKFs = mpMap->GetAllKeyFrames();
+    sort(vpKFs.begin(),vpKFs.end(),ORB_SLAM2::KeyFrame::lId);
+    vector<double> vKeyFrames;
+    vector<long long> vOffsets(1, 0);
+    vector<int> vIndices;
+    for(size_t i=0; i<vpKFs.size(); i++)
+    {
+        ORB_SLAM2::KeyFrame* pKF = vpKFs[i];
+        if(pKF->isBad())
+            continue;
+
+        cv::Mat R = pKF->GetRotation().t();
+        vector<float> q = ORB_SLAM2::Converter::toQuaternion(R);
+        cv::Mat t = pKF->GetCameraCenter();
+        double row[8] = {pKF->mTimeStamp, t.at<float>(0), t.at<float>(1), t.at<float>(2), q[0], q[1], q[2], q[3]};
+        vKeyFrames.insert(vKeyFrames.end(), row, row+8);
+
+        set<ORB_SLAM2::MapPoint*> spRefMPs = pKF->GetMapPoints();
+        for(set<ORB_SLAM2::MapPoint*>::iterator sit=spRefMPs.begin(), send=spRefMPs.end(); sit!=send; sit++)
+        {
+            if((*sit)->isBad())
+                continue;
+            map<ORB_SLAM2::MapPoint*, int>::iterator mit = mPointIndex.find(*sit);
+            if(mit == mPointIndex.end())
+            {
+                // Referenced but no longer in the map: append it to the table
+                cv::Mat pos = (*sit)->GetWorldPos();
+                mit = mPointIndex.insert(make_pair(*sit, (int)(vPoints.size()/3))).first;
+                vPoints.push_back(pos.at<float>(0));
+                vPoints.push_back(pos.at<float>(1));
+                vPoints.push_back(pos.at<float>(2));
+            }
+            vIndices.push_back(mit->second);
+        }
+        vOffsets.push_back(vIndices.size());
+    }
+
+    vector<size_t> shape;
+    shape.push_back(nImages); shape.push_back(8);
+    SaveNpy(prefix + "_Frame.npy", "<f8", shape, vFrames.data(), vFrames.size()*sizeof(double));
+    shape[0] = vKeyFrames.size()/8;
+    SaveNpy(prefix + "_keyFrame.npy", "<f8", shape, vKeyFrames.data(), vKeyFrames.size()*sizeof(double));
+    shape[0] = vPoints.size()/3; shape[1] = 3;
+    SaveNpy(prefix + "_mapPoint.npy", "<f4", shape, vPoints.data(), vPoints.size()*sizeof(float));
+    shape.resize(1);
+    shape[0] = vOffsets.size();
+    SaveNpy(prefix + "_refMapPointOffsets.npy", "<i8", shape, vOffsets.data(), vOffsets.size()*sizeof(long long));
+    shape[0] = vIndices.size();
+    SaveNpy(prefix + "_refMapPointIndex.npy", "<i4", shape, vIndices.data(), vIndices.size()*sizeof(int));
+    cout << endl << "binary files saved!" << endl;
+}
+
+void SaveNpy(const string &filename, const string &descr, const vector<size_t> &shape, const void *data, size_t nbytes)
+{
+    stringstream ss;
+    ss << "{'descr': '" << descr << "', 'fortran_order': False, 'shape': (";
+    for(size_t i=0; i<shape.size(); i++)
+        ss << shape[i] << (shape.size()==1 ? "," : (i+1<shape.size() ? ", " : ""));
+    ss << "), }";
+    string header = ss.str();
+
+    // magic (6) + version (2) + header length (2) + header, padded with spaces to a multiple of 64 and ended by '\n'
+    size_t total = 10 + header.size() + 1;
+    header.append((64 - total % 64) % 64, ' ');
+    header += '\n';
+    unsigned short len = header.size();
+
+    ofstream f;
+    f.open(filename.c_str(), ios::binary);
+    f.write("\x93NUMPY\x01\x00", 8);
+    f.write((const char*)&len, 2);
+    f.write(header.data(), header.size());
+    f.write((const char*)data, nbytes);
+    f.close();
 }
 
 void LoadImages(const string &strFile, vector<string> &vstrImageFilenames, vector<double> &vTimestamps)
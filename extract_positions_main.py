@@ -1,28 +1,66 @@
 import os
+import sys
 import numpy as np
 import argparse
-import tarfile
-# import data_process.extract_valid_positions
+import subprocess
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from extract_valid_positions import extract_cached
+from stage_cache import StageCache, stat_signature
+from telemetry import TELEMETRY_SUMMARY_FILE, print_summary, summarize_run, telemetry_path
+from tar_extract import unzip_tars
+from frame_store import FrameStore, video_archive
+from video_index import VIDEO_INDEX_FILE, VideoIndex, frame_source, list_videos
+from data_roots import add_root_arguments, resolve_roots
 
+SETTINGS_FILE = 'config.yaml'
+VOCABULARY_FILE = 'Vocabulary/ORBvoc.txt'
+SLAM_EXECUTABLE = './Examples/Monocular/extract_mono_epic'
+CACHE_MANIFEST = 'cache.json'
 
-def create_img_list(root_path, meta_path, n_start, n_end, fps=5, ori_fps=60):
+# valid frames: nframe consecutive keyframes closer than threshold to their frames
+NFRAME = 5
+THRESHOLD = 0.01
+
+
+def create_img_list(root_path, meta_path, n_start, n_end, fps=5, ori_fps=60, frames=None):
+    """Write the timestamped image list of frames [n_start, n_end) sampled at fps.
+
+    frames are the sorted frame numbers of the video, e.g. from VideoIndex.frames; the file
+    names then follow from the frame_{:010d}.jpg naming without listing the directory.
+    Frames of a video kept as an indexed archive are listed from the index and referred to
+    by their offset in the archive.
+    """
     save_file = os.path.join(root_path, meta_path, 'rgb_{}_{}.txt'.format(n_start, n_end))
     print('Create image list file: {}\n'.format(save_file))
+    interval = int(ori_fps / fps)
+    if interval == 0:
+        interval = 1
+    archive = video_archive(root_path)
     with open(save_file, 'w') as f:
+        if archive is not None:
+            store = FrameStore(archive)
+            rows = slice(n_start, n_end, interval)
+            for frame, ref in zip(store.frames[rows].tolist(), store.refs(rows)):
+                f.write('{0:.6f} {1}\n'.format(float(frame) / ori_fps, ref))
+            return
+        if frames is not None:
+            for frame in frames[n_start:n_end:interval].tolist():
+                filename = 'frame_{:010d}.jpg'.format(frame)
+                f.write('{0:.6f} {1}\n'.format(float(frame) / ori_fps, os.path.join(root_path, filename)))
+            return
         all_filename = [f for f in os.listdir(root_path) if f.endswith('.jpg')]
         all_filename.sort()
-        interval = int(ori_fps / fps)
-        if interval == 0:
-            interval = 1
         all_filename = all_filename[n_start:n_end:interval]
         for filename in all_filename:
             tframe = float(filename[6:-4]) / ori_fps
             f.write('{0:.6f} {1}\n'.format(tframe, os.path.join(root_path, filename)))
 
 
-def run_cpp(settings_file, timestamped_frames_file, save_prefix, use_viewer):
-    vocabulary_file = 'Vocabulary/ORBvoc.txt'
-    cmd = './Examples/Monocular/extract_mono_epic {}'.format(vocabulary_file)
+def run_cpp(settings_file, timestamped_frames_file, save_prefix, use_viewer, log_file=None, pacing='fixed',
+            output='text'):
+    cmd = '{} {}'.format(SLAM_EXECUTABLE, VOCABULARY_FILE)
 
     if not os.path.isfile(settings_file):
         raise IOError("Settings file doesn't exist: {}".format(settings_file))
@@ -33,19 +71,236 @@ def run_cpp(settings_file, timestamped_frames_file, save_prefix, use_viewer):
     cmd += ' {} '.format(timestamped_frames_file)
     cmd += ' {} '.format(save_prefix)
     cmd += ' {} '.format(use_viewer)
+    cmd += ' {} '.format(pacing)
+    cmd += ' {} '.format(output)
     print("Running command: '{}' \n".format(cmd))
-    return os.system(cmd)
+    sys.stdout.flush()
+    return subprocess.call(cmd, shell=True, stdout=log_file, stderr=subprocess.STDOUT if log_file else None)
+
+
+def run_cpp_worker(settings_file, jobs, manifest_path, use_viewer, log_path=None, pacing='fixed', output='text'):
+    """Run a single persistent extract_mono_epic over several sequences.
+
+    jobs is a list of (timestamped_frames_file, save_prefix) written to the manifest file read by
+    the worker, the map is reset between them. Returns {save_prefix: status} as reported by the
+    worker; jobs it never reported (e.g. after a crash) get status 1.
+    """
+    if not os.path.isfile(settings_file):
+        raise IOError("Settings file doesn't exist: {}".format(settings_file))
+
+    # a manifest file rather than stdin: the worker only reads the next job once it is done with
+    # the previous one, so writing many jobs to a pipe would block while its output is not read
+    with open(manifest_path, 'w') as f:
+        f.write(''.join('{} {}\n'.format(frames, prefix) for frames, prefix in jobs))
+    cmd = '{} {} {} --jobs {} {} {} {}'.format(SLAM_EXECUTABLE, VOCABULARY_FILE, settings_file, manifest_path,
+                                               use_viewer, pacing, output)
+    print("Running command: '{}' with {} jobs\n".format(cmd, len(jobs)))
+    sys.stdout.flush()
+
+    status = {}
+    log_file = open(log_path, 'w') if log_path else sys.stdout
+    try:
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        for line in proc.stdout:
+            log_file.write(line)
+            if line.startswith('Finished job: '):
+                prefix, _, code = line[len('Finished job: '):].rstrip('\n').rpartition(' status: ')
+                status[prefix] = int(code)
+        proc.wait()
+    finally:
+        if log_path:
+            log_file.close()
+    return {prefix: status.get(prefix, 1) for _, prefix in jobs}
+
+
+def sub_video_files(sub_data_path, metadata_path, sub_ns, sub_ne):
+    frames = os.path.join(sub_data_path, metadata_path, 'rgb_{}_{}.txt'.format(sub_ns, sub_ne))
+    prefix = os.path.join(sub_data_path, metadata_path, 'PosInfo_{}_{}'.format(sub_ns, sub_ne))
+    return frames, prefix
+
+
+def slam_outputs(prefix, output):
+    """Trajectory files written by extract_mono_epic with the given output setting."""
+    exts = {'text': ['txt'], 'npy': ['npy'], 'both': ['txt', 'npy']}[output]
+    return ['{}_{}.{}'.format(prefix, name, ext) for ext in exts for name in ['Frame', 'keyFrame']]
+
+
+def loaded_vocabulary():
+    """Vocabulary file extract_mono_epic loads: the ORBvoc.bin next to VOCABULARY_FILE when it is readable."""
+    bin_file = os.path.splitext(VOCABULARY_FILE)[0] + '.bin'
+    return bin_file if os.access(bin_file, os.R_OK) else VOCABULARY_FILE
+
+
+def slam_stage(frames, prefix, pacing, output):
+    """(inputs, params, outputs) of the SLAM stage in the cache.
+
+    The vocabulary and the executable are keyed on their size and mtime, hashing them would
+    read the vocabulary in every worker.
+    """
+    binaries = {path: stat_signature(path) for path in [loaded_vocabulary(), SLAM_EXECUTABLE]}
+    params = dict(pacing=pacing, output=output, binaries=binaries)
+    return [frames, SETTINGS_FILE], params, slam_outputs(prefix, output)
+
+
+def sub_video_cache(sub_data_path, metadata_path, use_cache=True):
+    return StageCache(os.path.join(sub_data_path, metadata_path, CACHE_MANIFEST), enabled=use_cache)
+
+
+def update_img_list(cache, sub_data_path, metadata_path, sub_ns, sub_ne, fps, ori_fps, frame_numbers=None):
+    """Create the image list file unless the cached one was made from the same frames and settings."""
+    frames, _ = sub_video_files(sub_data_path, metadata_path, sub_ns, sub_ne)
+    params = dict(n_start=sub_ns, n_end=sub_ne, fps=fps, ori_fps=ori_fps)
+    inputs = [frame_source(sub_data_path)]
+    if cache.fresh('image_list', inputs, params, [frames]):
+        print('Image list is up to date: {}\n'.format(frames))
+        return
+    create_img_list(sub_data_path, metadata_path, sub_ns, sub_ne, fps=fps, ori_fps=ori_fps, frames=frame_numbers)
+    cache.update('image_list', inputs, params, [frames])
+
+
+def process_sub_video(sub_data_path, metadata_path, sub_id, sub_ns, sub_ne, fps, use_viewer,
+                      only_extract_valid=False, log_path=None, pacing='fixed', output='text', use_cache=True,
+                      ori_fps=60, frames=None):
+    """Create the image list, run ORB-SLAM and extract valid frames for one sub-video.
+
+    ori_fps and frames (sorted frame numbers) of the video come from the VideoIndex.
+
+    Stages whose inputs and parameters are unchanged since their last run, as recorded in the
+    cache.json manifest of the metadata directory, are skipped unless use_cache is False.
+    Returns the exit code of the job (0 on success). When log_path is given, all output of
+    the job, including the one of extract_mono_epic, is written there instead of stdout.
+    """
+    log_file = open(log_path, 'w') if log_path else sys.stdout
+    try:
+        with redirect_stdout(log_file):
+            frames_file, prefix = sub_video_files(sub_data_path, metadata_path, sub_ns, sub_ne)
+            cache = sub_video_cache(sub_data_path, metadata_path, use_cache)
 
+            if not only_extract_valid:
+                # create img list file
+                update_img_list(cache, sub_data_path, metadata_path, sub_ns, sub_ne, fps, ori_fps, frames)
 
-def get_original_fps(sub_id):
-    ori_fps = 60
-    if sub_id in ['P09_07', 'P09_08', 'P10_01', 'P10_04', 'P11_01', 'P18_02', 'P18_03']:
-        ori_fps = 30
-    elif sub_id in ['P17_01', 'P17_02', 'P17_03', 'P17_04']:
-        ori_fps = 48
-    elif sub_id in ['P18_09']:
-        ori_fps = 90
-    return ori_fps
+                # run orb_slam to extract positions
+                inputs, params, outputs = slam_stage(frames_file, prefix, pacing, output)
+                if cache.fresh('slam', inputs, params, outputs):
+                    print('SLAM trajectory is up to date: {}\n'.format(prefix))
+                else:
+                    cache.invalidate('slam')
+                    ret = run_cpp(SETTINGS_FILE, frames_file, prefix, use_viewer, log_file if log_path else None,
+                                  pacing, output)
+                    if ret != 0:
+                        print('extract_mono_epic failed on {} with exit code {}'.format(sub_id, ret))
+                        return ret
+                    cache.update('slam', inputs, params, outputs)
+
+            # extract valid frames
+            extract_cached(NFRAME, THRESHOLD, prefix, os.path.join(sub_data_path, metadata_path), cache)
+        return 0
+    except Exception:
+        traceback.print_exc(file=log_file)
+        return 1
+    finally:
+        if log_path:
+            log_file.close()
+
+
+def video_job(sub_data_path, metadata_path, sub_id, video_index, ns=0, ne=-1, fps=60, use_viewer=0,
+              only_extract_valid=False, pacing='fast', output='text', use_cache=True):
+    """Arguments of process_sub_video for frames ns to ne (-1: all) of a video in video_index."""
+    return dict(sub_data_path=sub_data_path, metadata_path=metadata_path, sub_id=sub_id,
+                sub_ns=ns, sub_ne=video_index.num_frames(sub_id) if ne == -1 else ne, fps=fps, use_viewer=use_viewer,
+                only_extract_valid=only_extract_valid, pacing=pacing, output=output, use_cache=use_cache,
+                ori_fps=video_index.fps(sub_id), frames=video_index.frames(sub_id, sub_data_path))
+
+
+def run_parallel(jobs, n_workers, retries):
+    """Run process_sub_video jobs on a process pool, longest videos first.
+
+    jobs is a list of (sub_id, n_frames, kwargs). Failed jobs are resubmitted up to
+    retries times. Returns the {sub_id: exit code} of the last attempt of every job.
+    """
+    jobs = sorted(jobs, key=lambda job: job[1], reverse=True)
+    exit_codes = {}
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for attempt in range(retries + 1):
+            futures = [(sub_id, n_frames, kwargs, pool.submit(process_sub_video, **kwargs))
+                       for sub_id, n_frames, kwargs in jobs]
+            failed = []
+            for sub_id, n_frames, kwargs, future in futures:
+                exit_codes[sub_id] = future.result()
+                print('{} finished with exit code {} (log: {})'.format(sub_id, exit_codes[sub_id], kwargs['log_path']))
+                if exit_codes[sub_id] != 0:
+                    failed.append((sub_id, n_frames, kwargs))
+            if not failed:
+                break
+            if attempt < retries:
+                print('Retrying {} failed video(s): '.format(len(failed)), [job[0] for job in failed])
+            jobs = failed
+    return exit_codes
+
+
+def run_persistent(jobs, n_workers, retries, log_dir):
+    """Run SLAM for all jobs on n_workers persistent extract_mono_epic processes.
+
+    jobs is the same list as for run_parallel. Videos are assigned longest first to the worker
+    with the fewest queued frames. Valid frames are then extracted on a process pool, and
+    videos whose SLAM run failed are retried one process per video through run_parallel.
+    Videos whose SLAM stage is cached are not sent to the workers.
+    """
+    groups = [[] for _ in range(n_workers)]
+    loads = [0] * n_workers
+    status = {}
+    for sub_id, n_frames, job in sorted(jobs, key=lambda job: job[1], reverse=True):
+        cache = sub_video_cache(job['sub_data_path'], job['metadata_path'], job['use_cache'])
+        update_img_list(cache, job['sub_data_path'], job['metadata_path'], job['sub_ns'], job['sub_ne'], job['fps'],
+                        job['ori_fps'], job['frames'])
+        frames, prefix = sub_video_files(job['sub_data_path'], job['metadata_path'], job['sub_ns'], job['sub_ne'])
+        if cache.fresh('slam', *slam_stage(frames, prefix, job['pacing'], job['output'])):
+            print('SLAM trajectory is up to date: {}'.format(prefix))
+            status[prefix] = 0
+            continue
+        cache.invalidate('slam')
+        worker = int(np.argmin(loads))
+        groups[worker].append(job)
+        loads[worker] += n_frames
+
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = []
+        for worker, group in enumerate(groups):
+            if not group:
+                continue
+            worker_jobs = [sub_video_files(job['sub_data_path'], job['metadata_path'], job['sub_ns'], job['sub_ne'])
+                           for job in group]
+            manifest_path = os.path.join(log_dir, 'slam_worker_{}_jobs.txt'.format(worker))
+            futures.append((group, worker_jobs, pool.submit(run_cpp_worker, SETTINGS_FILE, worker_jobs, manifest_path,
+                                                            group[0]['use_viewer'],
+                                                            os.path.join(log_dir, 'slam_worker_{}.txt'.format(worker)),
+                                                            group[0]['pacing'], group[0]['output'])))
+        for group, worker_jobs, future in futures:
+            worker_status = future.result()
+            for job, (frames, prefix) in zip(group, worker_jobs):
+                if worker_status[prefix] == 0:
+                    cache = sub_video_cache(job['sub_data_path'], job['metadata_path'], job['use_cache'])
+                    cache.update('slam', *slam_stage(frames, prefix, job['pacing'], job['output']))
+            status.update(worker_status)
+
+    succeeded, failed = [], []
+    for sub_id, n_frames, job in jobs:
+        _, prefix = sub_video_files(job['sub_data_path'], job['metadata_path'], job['sub_ns'], job['sub_ne'])
+        if status[prefix] == 0:
+            succeeded.append((sub_id, n_frames, dict(job, only_extract_valid=True)))
+        else:
+            failed.append((sub_id, n_frames, job))
+
+    exit_codes = run_parallel(succeeded, n_workers, 0)
+    if failed:
+        print('SLAM failed in persistent workers for: ', [job[0] for job in failed])
+        if retries > 0:
+            exit_codes.update(run_parallel(failed, n_workers, retries - 1))
+        else:
+            exit_codes.update({sub_id: 1 for sub_id, _, _ in failed})
+    return exit_codes
 
 
 if __name__ == '__main__':
@@ -59,29 +314,38 @@ if __name__ == '__main__':
     parser.add_argument("--ne", default=-1, type=int, help="end frame")
     parser.add_argument("--use_viewer", default=1, help="whether to use viewer")
     parser.add_argument("--only_extract_valid", help="only extract valid frames from existing files", action="store_true")
-    args = parser.parse_args()
+    parser.add_argument("--pacing", default="fast",
+                        help="frame pacing of extract_mono_epic: realtime, fixed[:seconds] or fast")
+    parser.add_argument("--output", default="text", help="output files of extract_mono_epic: text, npy or both")
+    parser.add_argument("--jobs", default=1, type=int, help="number of sub-datasets processed in parallel")
+    parser.add_argument("--persistent", help="run ORB-SLAM in --jobs long-lived processes fed with all sub-datasets",
+                        action="store_true")
+    parser.add_argument("--retries", default=1, type=int, help="times a failed sub-dataset is retried with --jobs")
+    parser.add_argument("--skip_indexed", help="don't extract frame archives that are already indexed",
+                        action="store_true")
+    parser.add_argument("--index", help="only index frame archives, frames are then read from them without "
+                                        "extracting", action="store_true")
+    parser.add_argument("--video_info", help="EPIC_video_info.csv with the fps of every video "
+                                             "(default: <annotations_root>/EPIC_video_info.csv)")
+    parser.add_argument("--vis", help="plot the valid positions of every sub-dataset once all are processed",
+                        action="store_true")
+    parser.add_argument("--no_cache", help="rerun all stages even if their inputs and settings are unchanged",
+                        action="store_true")
+    add_root_arguments(parser)
+    args = resolve_roots(parser.parse_args())
+    if args.video_info is None:
+        args.video_info = os.path.join(args.annotations_root, 'EPIC_video_info.csv')
 
-    data_path_prefix = '/media/hdd1/guanjq/EPIC_KITCHENS_2018/frames_rgb_flow/rgb/'
+    data_path_prefix = args.rgb_root
     data_split = args.data_split
     data_path = os.path.join(data_path_prefix, data_split, args.data_id)
     print('Data Path: ', data_path)
 
     # unzip file if needed
-    to_unzip_file = [f for f in os.listdir(data_path) if f.endswith('.tar')]
-    if not to_unzip_file:
-        print('There is no file to be unzipped!')
-    else:
-        print('unzip {} file(s): '.format(len(to_unzip_file)), to_unzip_file)
-        for file in to_unzip_file:
-            file_dir = file.split('.')[0]
-            tar = tarfile.open(os.path.join(data_path, file), "r:")
-            tar.extractall(os.path.join(data_path, file_dir))
-            tar.close()
-            print('unzip {} and remove it.'.format(file))
-            os.remove(os.path.join(data_path, file))
-
-    sub_id_list = [f for f in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, f)) and f.startswith('P')]
-    sub_id_list.sort()
+    unzip_tars([data_path], args.jobs, skip_indexed=args.skip_indexed or args.index, index=args.index)
+
+    # videos kept as indexed archives are read without extracting them
+    sub_id_list = list_videos(data_path)
     print('Sub-dataset to be processed: ', sub_id_list)
     ns, ne = args.ns, args.ne
 
@@ -93,34 +357,58 @@ if __name__ == '__main__':
         process_id_list = sub_id_list
     else:
         sub_id = args.data_id + '_' + args.sub_data_id
-        if os.path.isdir(os.path.join(data_path, sub_id)):
+        if sub_id in sub_id_list:
             process_id_list = [sub_id]
         else:
             raise ValueError('Not found sub data id!')
 
-    for idx, sub_id in enumerate(process_id_list):
-        print('\nStart processing {} of {}: {}'.format(idx + 1, len(process_id_list), sub_id))
+    # frame numbers and fps of every video, only new or changed videos are scanned
+    metadata_path = args.metadata_path
+    video_index = VideoIndex(os.path.join(data_path_prefix, data_split, VIDEO_INDEX_FILE), args.video_info)
+    for sub_id in process_id_list:
         sub_data_path = os.path.join(data_path, sub_id)
-        metadata_path = args.metadata_path
         if not os.path.isdir(os.path.join(sub_data_path, metadata_path)):
-            os.mkdir(os.path.join(sub_data_path, metadata_path))
-
-        settings = "config.yaml"
-        sub_ns, sub_ne = ns, ne
-        if ne == -1:
-            sub_ne = len([f for f in os.listdir(sub_data_path) if f.endswith('.jpg')])
-        frames = os.path.join(sub_data_path, metadata_path, 'rgb_{}_{}.txt'.format(sub_ns, sub_ne))
-        prefix = os.path.join(sub_data_path, metadata_path, 'PosInfo_{}_{}'.format(sub_ns, sub_ne))
-        nframe = 5
-        threshold = 0.01
-
-        if not args.only_extract_valid:
-            # create img list file
-            ori_fps = get_original_fps(sub_id)
-            create_img_list(sub_data_path, metadata_path, sub_ns, sub_ne, fps=args.fps, ori_fps=ori_fps)
-
-            # run orb_slam to extract positions
-            run_cpp(settings, frames, prefix, args.use_viewer)
-
-        # extract valid frames
-        # extract_valid_positions.extract(nframe, threshold, prefix, os.path.join(sub_data_path, 'pos_info'))
+            os.makedirs(os.path.join(sub_data_path, metadata_path))
+        video_index.update(sub_id, sub_data_path)
+    video_index.save()
+
+    jobs = []
+    exit_codes = {}
+    telemetry_files = {}
+    for idx, sub_id in enumerate(process_id_list):
+        sub_data_path = os.path.join(data_path, sub_id)
+        job = video_job(sub_data_path, metadata_path, sub_id, video_index, ns, ne, args.fps, args.use_viewer,
+                        args.only_extract_valid, args.pacing, args.output, not args.no_cache)
+        sub_ns, sub_ne = job['sub_ns'], job['sub_ne']
+        telemetry_files[sub_id] = telemetry_path(sub_video_files(sub_data_path, metadata_path, sub_ns, sub_ne)[1])
+
+        if args.jobs > 1 or args.persistent:
+            if args.jobs > 1:
+                job['use_viewer'] = 0
+            job['log_path'] = os.path.join(sub_data_path, metadata_path, 'log_{}_{}.txt'.format(sub_ns, sub_ne))
+            jobs.append((sub_id, sub_ne - sub_ns, job))
+        else:
+            print('\nStart processing {} of {}: {}'.format(idx + 1, len(process_id_list), sub_id))
+            exit_codes[sub_id] = process_sub_video(**job)
+
+    if jobs:
+        print('\nProcessing {} sub-datasets with {} workers ...'.format(len(jobs), args.jobs))
+        if args.persistent and not args.only_extract_valid:
+            exit_codes = run_persistent(jobs, args.jobs, args.retries, data_path)
+        else:
+            exit_codes = run_parallel(jobs, args.jobs, args.retries)
+        failed = [sub_id for sub_id, ret in exit_codes.items() if ret != 0]
+        print('Finished {} of {} sub-datasets. Failed: '.format(len(jobs) - len(failed), len(jobs)), failed)
+
+    # tracking latency and lost ratios of the videos processed in this run
+    telemetry = summarize_run({sub_id: path for sub_id, path in telemetry_files.items()
+                               if exit_codes.get(sub_id) == 0})
+    if len(telemetry):
+        print_summary(telemetry)
+        telemetry.to_csv(os.path.join(data_path, TELEMETRY_SUMMARY_FILE))
+
+    if args.vis:
+        # rendering is kept out of the extraction, it runs on its own pool from the saved outputs
+        from plot_positions import plot_all
+        plot_all([os.path.join(data_path, sub_id, metadata_path) for sub_id, ret in sorted(exit_codes.items())
+                  if ret == 0], NFRAME, THRESHOLD, args.jobs)
@@ -1,86 +1,239 @@
 import os
 import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
 
 
-def extract(nframe, threshold, file_prefix, save_path):
+TRAJ_COLUMNS = ['t', 'x', 'y', 'z', 'q0', 'q1', 'q2', 'q3']
+TRAJ_DTYPE = np.dtype([(c, np.float64) for c in TRAJ_COLUMNS])
+
+
+def read_trajectory(traj_file, chunk_size=None):
+    """Read a PosInfo_*_Frame.txt / _keyFrame.txt file (t x y z q0 q1 q2 q3 per line).
+
+    The whole file is parsed in one bulk pass into float64 columns. With chunk_size set,
+    an iterator over DataFrames of at most chunk_size rows is returned instead, keeping
+    a running index so that the chunks concatenate to the same DataFrame.
+    """
+    if os.path.getsize(traj_file) == 0:
+        empty = pd.DataFrame(np.empty(0, dtype=TRAJ_DTYPE))
+        return empty if chunk_size is None else iter([empty])
+    return pd.read_csv(traj_file, sep=r'\s+', header=None, names=TRAJ_COLUMNS, dtype=np.float64,
+                       chunksize=chunk_size)
+
+
+def load_npy_trajectory(npy_file):
+    """Memory-map a _Frame.npy / _keyFrame.npy file written by extract_mono_epic (no copy)."""
+    return pd.DataFrame(np.load(npy_file, mmap_mode='r'), columns=TRAJ_COLUMNS, copy=False)
+
+
+def load_ref_map_points(file_prefix):
+    """Memory-map the binary map point table and the points referenced by each keyframe.
+
+    Returns (points, offsets, index): the map points of keyframe i (row i of _keyFrame.npy)
+    are points[index[offsets[i]:offsets[i + 1]]].
+    """
+    points = np.load('{}_mapPoint.npy'.format(file_prefix), mmap_mode='r')
+    offsets = np.load('{}_refMapPointOffsets.npy'.format(file_prefix), mmap_mode='r')
+    index = np.load('{}_refMapPointIndex.npy'.format(file_prefix), mmap_mode='r')
+    return points, offsets, index
+
+
+def trajectory_exists(file_prefix):
+    return os.path.isfile('{}_Frame.npy'.format(file_prefix)) or os.path.isfile('{}_Frame.txt'.format(file_prefix))
+
+
+def trajectory_files(file_prefix):
+    """The frame and keyframe trajectory files read by extract.
+
+    When both the binary and the text files exist, the newer ones are read, so that the
+    output of the last extract_mono_epic run wins; binary ones are preferred on a tie.
+    """
+    npy_file, txt_file = '{}_Frame.npy'.format(file_prefix), '{}_Frame.txt'.format(file_prefix)
+    if os.path.isfile(npy_file) and os.path.isfile(txt_file):
+        ext = 'npy' if os.path.getmtime(npy_file) >= os.path.getmtime(txt_file) else 'txt'
+    else:
+        ext = 'npy' if os.path.isfile(npy_file) else 'txt'
+    return '{}_Frame.{}'.format(file_prefix, ext), '{}_keyFrame.{}'.format(file_prefix, ext)
+
+
+def valid_frame_outputs(save_path):
+    return [os.path.join(save_path, name) for name in ['Frame.csv', 'keyFrame.csv', 'validFrame.csv']]
+
+
+def extract_cached(nframe, threshold, file_prefix, save_path, cache, chunk_size=None):
+    """extract unless the StageCache cache has its outputs for the same trajectory and parameters.
+
+    chunk_size doesn't change the outputs and is not part of the key.
+    Returns True if the valid frames were extracted again.
+    """
+    inputs = list(trajectory_files(file_prefix))
+    params = dict(nframe=nframe, threshold=threshold)
+    if cache.fresh('valid_frames', inputs, params, valid_frame_outputs(save_path)):
+        print('Valid frames are up to date: {}'.format(os.path.join(save_path, 'validFrame.csv')))
+        return False
+    extract(nframe, threshold, file_prefix, save_path, chunk_size)
+    cache.update('valid_frames', inputs, params, valid_frame_outputs(save_path))
+    return True
+
+
+def first_index(times, query):
+    """Positions of the first entry of times equal to each query timestamp."""
+    order = np.argsort(times, kind='stable')
+    pos = np.searchsorted(times, query, sorter=order)
+    found = pos < len(times)
+    found[found] = times[order[pos[found]]] == query[found]
+    if not np.all(found):
+        raise ValueError("Timestamps not found in trajectory: {}".format(query[~found]))
+    return order[pos]
+
+
+def detect_stable_segments(dist, nframe, threshold):
+    """Keyframe positions where stable segments start and end.
+
+    A segment starts at the first keyframe whose next {nframe} distances (truncated at the
+    end of the sequence) are all below threshold, and ends at the next keyframe whose
+    distance exceeds 2 * threshold. A segment still open at the end closes on the last keyframe.
+    """
+    n = len(dist)
+    bad = np.concatenate([[0], np.cumsum(~(dist < threshold))])
+    window_end = np.minimum(np.arange(n) + max(nframe, 0), n)
+    can_start = np.flatnonzero(bad[window_end] == bad[:n])
+    can_end = np.flatnonzero(dist > 2 * threshold)
+
+    start, end = [], []
+    nt = 0
+    while True:
+        i = np.searchsorted(can_start, nt)
+        if i == len(can_start):
+            break
+        start.append(can_start[i])
+        j = np.searchsorted(can_end, can_start[i] + 1)
+        if j == len(can_end):
+            end.append(n - 1)
+            break
+        end.append(can_end[j])
+        nt = can_end[j] + 1
+    return np.array(start, dtype=np.int64), np.array(end, dtype=np.int64)
+
+
+def _concat_ranges(starts, stops):
+    # np.concatenate([np.arange(s, e) for s, e in zip(starts, stops)]) without the Python loop
+    lengths = np.maximum(stops - starts, 0)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+def keyframe_distances(full_traj, key_traj):
+    """Distance between each keyframe and the frame with the same timestamp."""
+    frame_t = full_traj.t.values
+    key_t = key_traj.t.values
+    frame_pos = full_traj[['x', 'y', 'z']].values[first_index(frame_t, key_t)]
+    keyframe_pos = key_traj[['x', 'y', 'z']].values[first_index(key_t, key_t)]
+    return np.linalg.norm(frame_pos - keyframe_pos, axis=1)
+
+
+def _extract_streamed(nframe, threshold, frame_traj_file, keyframe_traj_file, save_path, chunk_size):
+    # Same outputs as extract, but the frame trajectory is read twice, chunk by chunk, and never held whole:
+    # pass 1 writes Frame.csv and keeps the frames of the keyframe timestamps, pass 2 writes validFrame.csv.
+    key_traj = read_trajectory(keyframe_traj_file)
+    key_traj.to_csv(os.path.join(save_path, 'keyFrame.csv'))
+    key_t = key_traj.t.values
+
+    n_frames, n_lost = 0, 0
+    match_index, match_t, match_pos = [], [], []
+    frame_csv = os.path.join(save_path, 'Frame.csv')
+    for i, chunk in enumerate(read_trajectory(frame_traj_file, chunk_size)):
+        chunk.to_csv(frame_csv, mode='w' if i == 0 else 'a', header=i == 0)
+        n_frames += len(chunk)
+        n_lost += np.count_nonzero(chunk.x.values == 0)
+        rows = np.flatnonzero(np.isin(chunk.t.values, key_t))
+        match_index.append(chunk.index.values[rows])
+        match_t.append(chunk.t.values[rows])
+        match_pos.append(chunk[['x', 'y', 'z']].values[rows])
+    match_index, match_t = np.concatenate(match_index), np.concatenate(match_t)
+    match_pos = np.concatenate(match_pos).reshape(-1, 3)
+
+    # Calculate distances between each keyframe and the frame with the same timestamp
+    key_rows = first_index(match_t, key_t)
+    keyframe_pos = key_traj[['x', 'y', 'z']].values[first_index(key_t, key_t)]
+    dist = np.linalg.norm(match_pos[key_rows] - keyframe_pos, axis=1)
+
+    # If {nframe} consecutive distances between frames and keyframes < threshold, we believe the positions are stable
+    start_kf, end_kf = detect_stable_segments(dist, nframe, threshold)
+    stable_start_frame = key_t[start_kf].tolist()
+    stable_end_frame = key_t[end_kf].tolist()
+
+    print("stable start frame: ", stable_start_frame)
+    print("stable end frame: ", stable_end_frame)
+    assert len(stable_start_frame) == len(stable_end_frame)
+
+    # Incorporate all stable positions, without the tracking lost ones except the first keyframe (0, 0, 0)
+    s_idx = match_index[key_rows[start_kf]]
+    e_idx = match_index[key_rows[end_kf]]
+    n_valid = 0
+    valid_csv = os.path.join(save_path, 'validFrame.csv')
+    for i, chunk in enumerate(read_trajectory(frame_traj_file, chunk_size)):
+        index = chunk.index.values
+        segment = np.searchsorted(s_idx, index, side='right') - 1
+        valid = segment >= 0
+        valid[valid] = index[valid] <= e_idx[segment[valid]]
+        if len(stable_start_frame) != 0:
+            valid &= (chunk.x.values != 0) | (chunk.t.values == stable_start_frame[0])
+        chunk[valid].to_csv(valid_csv, mode='w' if i == 0 else 'a', header=i == 0)
+        n_valid += np.count_nonzero(valid)
+
+    print('Total frames: {} \t Total keyframes: {} \t Total valid frames: {} ({}) \n'
+          'Tracking lost or uninitialized frames: {} ({})'.
+          format(n_frames, len(key_traj), n_valid, n_valid / n_frames, n_lost, n_lost / n_frames))
+
+    return stable_start_frame, stable_end_frame
+
+
+def extract(nframe, threshold, file_prefix, save_path, chunk_size=None):
+    """Write Frame.csv, keyFrame.csv and validFrame.csv of a trajectory to save_path.
+
+    With chunk_size set, a text frame trajectory is streamed in chunks of at most chunk_size
+    rows, so that memory stays bounded on very long sequences. Binary trajectories are
+    memory-mapped and always read in one pass.
+    Returns the timestamps of the starts and ends of the stable segments.
+    """
     print("Extracting valid positions ...")
-    frame_traj_file = '{}_Frame.txt'.format(file_prefix)
-    keyframe_traj_file = '{}_keyFrame.txt'.format(file_prefix)
+    frame_traj_file, keyframe_traj_file = trajectory_files(file_prefix)
+    use_npy = frame_traj_file.endswith('.npy')
     if not os.path.isfile(frame_traj_file):
         raise IOError("Frames info file doesn't exist: {}".format(frame_traj_file))
     if not os.path.isfile(keyframe_traj_file):
         raise IOError("Keyframes info file doesn't exist: {}".format(keyframe_traj_file))
+    if chunk_size is not None and not use_npy:
+        return _extract_streamed(nframe, threshold, frame_traj_file, keyframe_traj_file, save_path, chunk_size)
 
-    full_traj = pd.DataFrame(columns=['t', 'x', 'y', 'z', 'q0', 'q1', 'q2', 'q3'])
-    key_traj = pd.DataFrame(columns=['t', 'x', 'y', 'z', 'q0', 'q1', 'q2', 'q3'])
-    with open(frame_traj_file, 'r') as f:
-        for line in f.readlines():
-            frame_info = [float(d) for d in line.split()]
-            full_traj = full_traj.append({'t': frame_info[0],
-                                          'x': frame_info[1],
-                                          'y': frame_info[2],
-                                          'z': frame_info[3],
-                                          'q0': frame_info[4],
-                                          'q1': frame_info[5],
-                                          'q2': frame_info[6],
-                                          'q3': frame_info[7]}, ignore_index=True)
-
-    with open(keyframe_traj_file, 'r') as f:
-        for line in f.readlines():
-            frame_info = [float(d) for d in line.split()]
-            key_traj = key_traj.append({'t': frame_info[0],
-                                        'x': frame_info[1],
-                                        'y': frame_info[2],
-                                        'z': frame_info[3],
-                                        'q0': frame_info[4],
-                                        'q1': frame_info[5],
-                                        'q2': frame_info[6],
-                                        'q3': frame_info[7]}, ignore_index=True)
-
+    if use_npy:
+        full_traj = load_npy_trajectory(frame_traj_file)
+        key_traj = load_npy_trajectory(keyframe_traj_file)
+    else:
+        full_traj = read_trajectory(frame_traj_file)
+        key_traj = read_trajectory(keyframe_traj_file)
     full_traj.to_csv(os.path.join(save_path, 'Frame.csv'))
     key_traj.to_csv(os.path.join(save_path, 'keyFrame.csv'))
 
-    # Calculate distances
-    dist = []
-    for frame_id in key_traj.t:
-        frame_pos = (full_traj[full_traj.t == frame_id].iloc[0, 1:4]).values
-        keyframe_pos = (key_traj[key_traj.t == frame_id].iloc[0, 1:4]).values
-        # print('frame_id: %d' % frame_id, ' frame pos: ', frame_pos, '\t key frame pos: ', keyframe_pos)
-        dist.append(np.linalg.norm(frame_pos - keyframe_pos))
-    dist = np.array(dist)
+    # Calculate distances between each keyframe and the frame with the same timestamp
+    frame_t = full_traj.t.values
+    key_t = key_traj.t.values
+    dist = keyframe_distances(full_traj, key_traj)
 
     # If {nframe} consecutive distances between frames and keyframes < threshold, we believe the positions are stable
-    stable_start_frame = []
-    stable_end_frame = []
-    stable_flag = False
-
-    for nt in range(len(key_traj.t)):
-        if not stable_flag:
-            if np.all(dist[nt:nt+nframe] < threshold):
-                stable_start_frame.append(key_traj.t[nt])
-                stable_flag = True
-        else:
-            if dist[nt] > 2 * threshold:
-                stable_end_frame.append(key_traj.t[nt])
-                stable_flag = False
-
-    if stable_flag:
-        stable_end_frame.append(key_traj.t.values[-1])
+    start_kf, end_kf = detect_stable_segments(dist, nframe, threshold)
+    stable_start_frame = key_t[start_kf].tolist()
+    stable_end_frame = key_t[end_kf].tolist()
 
     print("stable start frame: ", stable_start_frame)
     print("stable end frame: ", stable_end_frame)
     assert len(stable_start_frame) == len(stable_end_frame)
 
     # Incorporate all stable positions
-    valid_full_traj = pd.DataFrame(columns=['t', 'x', 'y', 'z', 'q0', 'q1', 'q2', 'q3'])
-    for s, e in zip(stable_start_frame, stable_end_frame):
-        s_idx = full_traj[full_traj.t == s].index.values[0]
-        e_idx = full_traj[full_traj.t == e].index.values[0]
-        valid_full_traj = pd.concat([valid_full_traj, full_traj[s_idx:e_idx + 1]])
+    s_idx = first_index(frame_t, key_t[start_kf])
+    e_idx = first_index(frame_t, key_t[end_kf])
+    valid_full_traj = full_traj.iloc[_concat_ranges(s_idx, e_idx + 1)]
 
     # Remove tracking lost positions
     # valid frames may start at the first keyframe (0, 0, 0), which is removed
@@ -101,46 +254,4 @@ def extract(nframe, threshold, file_prefix, save_path):
               format(len(full_traj), len(key_traj), len(valid_full_traj), len(valid_full_traj) / len(full_traj),
                      len(total_drop_index), len(total_drop_index) / len(full_traj)))
 
-    # Visualization
-    fig = plt.figure(figsize=(18, 4))
-    ax1 = fig.add_subplot(131)
-    ax2 = fig.add_subplot(132)
-    ax3 = fig.add_subplot(133)
-
-    # 1: plot frames
-    drop_index = full_traj[full_traj.x == 0].index
-    ax1.plot(-full_traj.drop(drop_index).y, full_traj.drop(drop_index).x)
-    if len(key_traj) != 0:
-        ax1.plot(-key_traj.y, key_traj.x, color='y')
-    x_ticks = ax1.get_xticks()
-    y_ticks = ax1.get_yticks()
-    ax1.set_title('Frames and KeyFrames')
-    ax1.set_xlabel('x')
-    ax1.set_ylabel('y')
-    ax1.legend(['Frame', 'KeyFrame'])
-
-    # 2: plot stable frames
-    if len(stable_start_frame) != 0:
-        for s, e in zip(stable_start_frame, stable_end_frame):
-            s_idx = valid_full_traj[valid_full_traj.t == s].index.values[0]
-            e_idx = valid_full_traj[valid_full_traj.t == e].index.values[0]
-            ax2.plot(-valid_full_traj.loc[s_idx:e_idx].y, valid_full_traj.loc[s_idx:e_idx].x)
-
-    ax2.set_xticks(x_ticks)
-    ax2.set_yticks(y_ticks)
-    ax2.set_title('Stable Frames')
-    ax2.set_xlabel('x')
-    ax2.set_ylabel('y')
-
-    # 3: plot distances between frames and keyframes
-    ax3.plot(key_traj.t, dist)
-    ax3.set_title('Distance between frames and keyframes')
-    ax3.set_xlabel('Frame')
-    ax3.set_ylabel('Distance')
-
-    plt.savefig(os.path.join(save_path, 'vis.png'))
-    print('Save visualization result in vis.png!')
-    plt.close()
-    # plt.show()
-
     return stable_start_frame, stable_end_frame
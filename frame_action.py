@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+
+class FrameActionSlice(object):
+    """Actions of consecutive frames of one video, a view on the FrameAction arrays.
+
+    offsets has one more entry than frames, the [verb, noun] pairs of frame i are
+    pairs[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, offsets, pairs):
+        self.offsets = offsets
+        self.pairs = pairs
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.pairs[self.offsets[i]:self.offsets[i + 1]]
+
+    def to_arrays(self):
+        """Offsets starting at 0 and the pairs of the slice only."""
+        return self.offsets - self.offsets[0], self.pairs[self.offsets[0]:self.offsets[-1]]
+
+    def tolist(self):
+        """Nested lists as built by the former --make_fav, [[-1, -1]] for frames without action."""
+        pairs = self.pairs[self.offsets[0]:self.offsets[-1]].tolist()
+        counts = np.diff(self.offsets).tolist()
+        actions = []
+        start = 0
+        for n in counts:
+            actions.append(pairs[start:start + n] if n else [[-1, -1]])
+            start += n
+        return actions
+
+
+class FrameAction(object):
+    """[verb, noun] pairs of every frame of every video in CSR layout.
+
+    Frames of video v are frame_offsets[video_offsets[v]:video_offsets[v + 1] + 1], the pairs
+    of a frame keep the order of the action labels.
+    """
+
+    def __init__(self, video_ids, video_offsets, frame_offsets, pairs):
+        self.video_ids = np.asarray(video_ids)
+        self.video_offsets = video_offsets
+        self.frame_offsets = frame_offsets
+        self.pairs = pairs
+        self._video_index = {video_id: i for i, video_id in enumerate(self.video_ids.tolist())}
+
+    @classmethod
+    def build(cls, labels, num_frames):
+        """Build from the EPIC action labels (video_id, start_frame, stop_frame, verb_class, noun_class)
+        and a Series of the number of frames indexed by video id.
+
+        Action intervals are inclusive and clipped to the frames of their video.
+        """
+        video_ids = num_frames.index.values
+        video_offsets = np.concatenate([[0], np.cumsum(num_frames.values)]).astype(np.int64)
+
+        video = pd.Index(video_ids).get_indexer(labels.video_id.values)
+        if np.any(video < 0):
+            raise KeyError('Videos missing in video info: {}'.format(np.unique(labels.video_id.values[video < 0])))
+        n_frames = num_frames.values[video]
+        start = np.clip(labels.start_frame.values, 0, n_frames).astype(np.int64)
+        stop = np.clip(labels.stop_frame.values + 1, 0, n_frames).astype(np.int64)
+
+        # expand every action to the global index of each of its frames
+        lengths = np.maximum(stop - start, 0)
+        first = video_offsets[video] + start
+        frames = np.repeat(first - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        action = np.repeat(np.arange(len(labels)), lengths)
+
+        # stable sort keeps the label order within a frame
+        order = np.argsort(frames, kind='stable')
+        counts = np.bincount(frames, minlength=video_offsets[-1])
+        frame_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        verb_noun = np.stack([labels.verb_class.values, labels.noun_class.values], axis=1).astype(np.int32)
+        pairs = verb_noun[action[order]]
+        return cls(video_ids.astype(str), video_offsets, frame_offsets, pairs)
+
+    def save(self, path):
+        np.savez(path, video_ids=self.video_ids.astype(str), video_offsets=self.video_offsets,
+                 frame_offsets=self.frame_offsets, pairs=self.pairs)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['video_ids'], data['video_offsets'], data['frame_offsets'], data['pairs'])
+
+    def __contains__(self, video_id):
+        return video_id in self._video_index
+
+    def num_frames(self, video_id):
+        v = self._video_index[video_id]
+        return int(self.video_offsets[v + 1] - self.video_offsets[v])
+
+    def actions(self, video_id, start, stop):
+        """Actions of frames [start, stop) of a video, clipped to its frames, without copying."""
+        v = self._video_index[video_id]
+        first, last = self.video_offsets[v], self.video_offsets[v + 1]
+        start = min(max(first + start, first), last)
+        stop = min(max(first + stop, start), last)
+        return FrameActionSlice(self.frame_offsets[start:stop + 1], self.pairs)
@@ -0,0 +1,77 @@
+import os
+import re
+import mmap
+import numpy as np
+from tar_extract import index_path, index_tar, is_indexed
+
+
+FRAME_NAME = re.compile(r'frame_(\d+)\.jpg$')
+
+
+def video_archive(video_path):
+    """The indexed archive P01/P01_01.tar of a video directory P01/P01_01, None if there is none."""
+    tar_path = os.path.normpath(video_path) + '.tar'
+    return tar_path if os.path.isfile(tar_path) and is_indexed(tar_path) else None
+
+
+def frame_ref(tar_path, offset, size):
+    """Reference to a JPEG inside an uncompressed tar, accepted by extract_mono_epic in image lists."""
+    return '{}@{}:{}'.format(tar_path, offset, size)
+
+
+class FrameStore(object):
+    """JPEG frames of one video served from its uncompressed tar without extracting them.
+
+    Frames are looked up by frame number (frame_{:010d}.jpg) through the index written by
+    tar_extract.index_tar, which is built on first use. subdir selects the frames of one
+    directory of the archive, e.g. 'u' or 'v' for flow archives.
+    """
+
+    def __init__(self, tar_path, subdir=''):
+        if not is_indexed(tar_path):
+            index_tar(tar_path)
+        self.tar_path = os.path.abspath(tar_path)
+        index = np.load(index_path(tar_path))
+        frames, rows = [], []
+        for row, name in enumerate(index['name'].tolist()):
+            dir_name, file_name = os.path.split(os.path.normpath(name))
+            match = FRAME_NAME.match(file_name)
+            if match and dir_name == subdir:
+                frames.append(int(match.group(1)))
+                rows.append(row)
+        order = np.argsort(frames, kind='stable')
+        self.frames = np.array(frames, dtype=np.int64)[order]
+        self.offsets = index['offset'][rows][order]
+        self.sizes = index['size'][rows][order]
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _position(self, frame):
+        i = np.searchsorted(self.frames, frame)
+        if i == len(self.frames) or self.frames[i] != frame:
+            raise KeyError('Frame {} not in {}'.format(frame, self.tar_path))
+        return i
+
+    def read(self, frame):
+        """JPEG bytes of a frame."""
+        if self._mmap is None:
+            with open(self.tar_path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        i = self._position(frame)
+        return self._mmap[self.offsets[i]:self.offsets[i] + self.sizes[i]]
+
+    def ref(self, frame):
+        i = self._position(frame)
+        return frame_ref(self.tar_path, self.offsets[i], self.sizes[i])
+
+    def refs(self, rows):
+        """References of the frames at positions rows (a slice or array) of self.frames."""
+        return [frame_ref(self.tar_path, offset, size)
+                for offset, size in zip(self.offsets[rows].tolist(), self.sizes[rows].tolist())]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
@@ -0,0 +1,86 @@
+/**
+* This file is part of ORB-SLAM2.
+*
+* Copyright (C) 2014-2016 Raúl Mur-Artal <raulmur at unizar dot es> (University of Zaragoza)
+* For more information see <https://github.com/raulmur/ORB_SLAM2>
+*
+* ORB-SLAM2 is free software: you can redistribute it and/or modify
+* it under the terms of the GNU General Public License as published by
+* the Free Software Foundation, either version 3 of the License, or
+* (at your option) any later version.
+*
+* ORB-SLAM2 is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with ORB-SLAM2. If not, see <http://www.gnu.org/licenses/>.
+*/
+
+
+#ifndef IMAGEPREFETCHER_H
+#define IMAGEPREFETCHER_H
+
+#include <map>
+#include <string>
+#include <vector>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <opencv2/core/core.hpp>
+
+namespace ORB_SLAM2
+{
+
+// Decodes the images of a sequence ahead of the tracking thread.
+// Up to nQueueDepth images beyond the last one returned are decoded by nThreads loader threads.
+// A filename of the form archive.tar@offset:size refers to a JPEG stored uncompressed inside a tar,
+// which is read from the archive without extracting it.
+class ImagePrefetcher
+{
+public:
+    ImagePrefetcher(const std::vector<std::string> &vstrFilenames, const int flags, const int nQueueDepth, const int nThreads);
+    ~ImagePrefetcher();
+
+    // Returns image ni (empty if it could not be loaded), waiting until it is decoded.
+    // Images must be requested one after the other, starting from 0.
+    cv::Mat Get(const size_t ni);
+
+    // Total time (seconds) Get() has waited for the loader threads
+    double GetStallTime();
+
+protected:
+
+    void Run();
+
+    cv::Mat LoadImage(const std::string &strFilename);
+
+    // Returns a file descriptor of the archive, opened once and shared by the loader threads (-1 on failure)
+    int GetArchive(const std::string &strArchive);
+
+    std::vector<std::string> mvstrFilenames;
+    int mFlags;
+    size_t mnQueueDepth;
+
+    // Next image to be claimed by a loader thread and first image not yet returned by Get()
+    size_t mnNext;
+    size_t mnConsumed;
+    std::map<size_t, cv::Mat> mmReady;
+
+    bool mbFinish;
+    double mStallTime;
+
+    std::mutex mMutexQueue;
+    std::condition_variable mCondFree;
+    std::condition_variable mCondReady;
+
+    std::vector<std::thread> mvThreads;
+
+    std::map<std::string, int> mmArchives;
+    std::mutex mMutexArchives;
+};
+
+} //namespace ORB_SLAM
+
+#endif // IMAGEPREFETCHER_H
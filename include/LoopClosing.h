@@ -62,6 +62,11 @@ public:
 
     void InsertKeyFrame(KeyFrame *pKF);
 
+    int KeyframesInQueue(){
+        unique_lock<std::mutex> lock(mMutexLoopQueue);
+        return mlpLoopKeyFrameQueue.size();
+    }
+
     void RequestReset();
 
     // This function will run in a separate thread
@@ -23,6 +23,9 @@
 
 #include <vector>
 #include <list>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
 #include <opencv/cv.h>
 
 
@@ -48,14 +51,16 @@ public:
     
     enum {HARRIS_SCORE=0, FAST_SCORE=1 };
 
+    // The pyramid levels are processed by nThreads threads (the calling thread and nThreads-1 workers).
     ORBextractor(int nfeatures, float scaleFactor, int nlevels,
-                 int iniThFAST, int minThFAST);
+                 int iniThFAST, int minThFAST, int nThreads=1);
 
-    ~ORBextractor(){}
+    ~ORBextractor();
 
     // Compute the ORB features and descriptors on an image.
     // ORB are dispersed on the image using an octree.
     // Mask is ignored in the current implementation.
+    // Keypoints and descriptors are ordered by level, the same for any number of threads.
     void operator()( cv::InputArray image, cv::InputArray mask,
       std::vector<cv::KeyPoint>& keypoints,
       cv::OutputArray descriptors);
@@ -63,6 +68,9 @@ public:
     int inline GetLevels(){
         return nlevels;}
 
+    int inline GetThreads(){
+        return nthreads;}
+
     float inline GetScaleFactor(){
         return scaleFactor;}
 
@@ -88,6 +96,9 @@ protected:
 
     void ComputePyramid(cv::Mat image);
     void ComputeKeyPointsOctTree(std::vector<std::vector<cv::KeyPoint> >& allKeypoints);    
+    void ComputeKeyPointsLevel(const int level, std::vector<cv::KeyPoint>& keypoints);
+    // Keypoints and descriptors of one level of the pyramid, keypoint coordinates scaled to level 0
+    void ExtractLevel(const int level, std::vector<cv::KeyPoint>& keypoints, cv::Mat& descriptors);
     std::vector<cv::KeyPoint> DistributeOctTree(const std::vector<cv::KeyPoint>& vToDistributeKeys, const int &minX,
                                            const int &maxX, const int &minY, const int &maxY, const int &nFeatures, const int &level);
 
@@ -108,6 +119,22 @@ protected:
     std::vector<float> mvInvScaleFactor;    
     std::vector<float> mvLevelSigma2;
     std::vector<float> mvInvLevelSigma2;
+
+    // Thread pool: the levels of the current image are claimed one by one, largest first
+    void RunWorker();
+    bool ExtractNextLevel(std::unique_lock<std::mutex> &lock);
+
+    int nthreads;
+    std::vector<std::thread> mvThreads;
+    std::mutex mMutexPool;
+    std::condition_variable mCondWork;
+    std::condition_variable mCondDone;
+    unsigned long mnImage;
+    int mnNextLevel;
+    int mnLevelsDone;
+    bool mbFinish;
+    std::vector<std::vector<cv::KeyPoint> >* mpvLevelKeypoints;
+    std::vector<cv::Mat>* mpvLevelDescriptors;
 };
 
 } //namespace ORB_SLAM
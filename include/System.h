@@ -122,6 +122,19 @@ public:
     int GetTrackingState();
     std::vector<MapPoint*> GetTrackedMapPoints();
     std::vector<cv::KeyPoint> GetTrackedKeyPointsUn();
+
+    // Returns true if Local Mapping has no keyframes waiting and is not processing one.
+    // Offline drivers can wait on this instead of sleeping a fixed time per frame.
+    bool LocalMappingIdle();
+
+    // Waits until Local Mapping and Loop Closing have processed all inserted keyframes
+    // (including a running global BA), so that the map can be saved without Shutdown().
+    void WaitForMapping();
+
+    // Number of keyframes waiting to be processed by Local Mapping and by Loop Closing
+    int LocalMappingQueueSize();
+    int LoopClosingQueueSize();
+
     Map* get_map() const
     {
     	return mpMap;
@@ -0,0 +1,108 @@
+import os
+import argparse
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from extract_valid_positions import detect_stable_segments, keyframe_distances
+
+
+def plot_valid_positions(nframe, threshold, save_path):
+    """Draw vis.png of a directory written by extract from its Frame.csv, keyFrame.csv and validFrame.csv.
+
+    nframe and threshold must be those given to extract, the stable segments are detected again
+    from the saved trajectories.
+    """
+    # imported here so that the extraction itself never loads matplotlib
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
+    # round_trip parsing gives back the exact values extract worked on
+    full_traj = pd.read_csv(os.path.join(save_path, 'Frame.csv'), index_col=0, float_precision='round_trip')
+    key_traj = pd.read_csv(os.path.join(save_path, 'keyFrame.csv'), index_col=0, float_precision='round_trip')
+    valid_full_traj = pd.read_csv(os.path.join(save_path, 'validFrame.csv'), index_col=0, float_precision='round_trip')
+    dist = keyframe_distances(full_traj, key_traj)
+    start_kf, end_kf = detect_stable_segments(dist, nframe, threshold)
+    stable_start_frame = key_traj.t.values[start_kf].tolist()
+    stable_end_frame = key_traj.t.values[end_kf].tolist()
+
+    fig = plt.figure(figsize=(18, 4))
+    ax1 = fig.add_subplot(131)
+    ax2 = fig.add_subplot(132)
+    ax3 = fig.add_subplot(133)
+
+    # 1: plot frames
+    drop_index = full_traj[full_traj.x == 0].index
+    ax1.plot(-full_traj.drop(drop_index).y, full_traj.drop(drop_index).x)
+    if len(key_traj) != 0:
+        ax1.plot(-key_traj.y, key_traj.x, color='y')
+    x_ticks = ax1.get_xticks()
+    y_ticks = ax1.get_yticks()
+    ax1.set_title('Frames and KeyFrames')
+    ax1.set_xlabel('x')
+    ax1.set_ylabel('y')
+    ax1.legend(['Frame', 'KeyFrame'])
+
+    # 2: plot stable frames
+    if len(stable_start_frame) != 0:
+        for s, e in zip(stable_start_frame, stable_end_frame):
+            s_idx = valid_full_traj[valid_full_traj.t == s].index.values[0]
+            e_idx = valid_full_traj[valid_full_traj.t == e].index.values[0]
+            ax2.plot(-valid_full_traj.loc[s_idx:e_idx].y, valid_full_traj.loc[s_idx:e_idx].x)
+
+    ax2.set_xticks(x_ticks)
+    ax2.set_yticks(y_ticks)
+    ax2.set_title('Stable Frames')
+    ax2.set_xlabel('x')
+    ax2.set_ylabel('y')
+
+    # 3: plot distances between frames and keyframes
+    ax3.plot(key_traj.t, dist)
+    ax3.set_title('Distance between frames and keyframes')
+    ax3.set_xlabel('Frame')
+    ax3.set_ylabel('Distance')
+
+    plt.savefig(os.path.join(save_path, 'vis.png'))
+    plt.close(fig)
+
+
+def _plot(nframe, threshold, save_path):
+    try:
+        plot_valid_positions(nframe, threshold, save_path)
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+def plot_all(save_paths, nframe, threshold, n_workers=1, force=False):
+    """Plot the extraction results of every directory of save_paths on a process pool.
+
+    Directories whose vis.png is newer than their validFrame.csv are skipped unless force.
+    Returns the directories that failed.
+    """
+    def outdated(save_path):
+        vis_file = os.path.join(save_path, 'vis.png')
+        return force or not os.path.isfile(vis_file) or \
+            os.path.getmtime(vis_file) < os.path.getmtime(os.path.join(save_path, 'validFrame.csv'))
+
+    save_paths = [save_path for save_path in save_paths if outdated(save_path)]
+    print('Plotting valid positions of {} video(s) ...'.format(len(save_paths)))
+    with ProcessPoolExecutor(max_workers=max(n_workers, 1)) as pool:
+        status = list(pool.map(_plot, [nframe] * len(save_paths), [threshold] * len(save_paths), save_paths))
+    failed = [save_path for save_path, ret in zip(save_paths, status) if ret != 0]
+    if failed:
+        print('Failed to plot: ', failed)
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("save_paths", nargs='+', help="directories with the outputs of extract (e.g. pos_info)")
+    parser.add_argument("--nframe", default=5, type=int)
+    parser.add_argument("--threshold", default=0.01, type=float)
+    parser.add_argument("--jobs", default=1, type=int, help="number of plotting processes")
+    parser.add_argument("--force", help="plot again even if vis.png is up to date", action="store_true")
+    args = parser.parse_args()
+
+    plot_all(args.save_paths, args.nframe, args.threshold, args.jobs, args.force)
@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import socket
+import tarfile
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from data_roots import add_root_arguments, resolve_roots
+from ego_store import EgoStore, EgoStoreWriter
+from extract_examples import video_examples
+from extract_positions_main import process_sub_video, video_job
+from frame_action import FrameAction
+from frame_store import FRAME_NAME, video_archive
+from tar_extract import extract_tar
+from video_index import VIDEO_INDEX_FILE, VideoIndex, list_videos
+
+
+MANIFEST_FILE = 'manifest.csv'
+METADATA_PATH = 'pos_info'
+
+# seconds between two refreshes of a held lock, and without refresh after which a lock is left from a dead worker
+HEARTBEAT = 60
+LOCK_TIMEOUT = 600
+
+
+def unit_id(split, video):
+    return '{}_{}'.format(split, video)
+
+
+def done_path(run_dir, unit):
+    return os.path.join(run_dir, 'done', unit + '.json')
+
+
+def failed_path(run_dir, unit):
+    return os.path.join(run_dir, 'failed', unit + '.json')
+
+
+def lock_path(run_dir, unit):
+    return os.path.join(run_dir, 'locks', unit + '.lock')
+
+
+def write_record(path, record):
+    """Write a json record atomically, readers see either the previous or the complete new record."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def read_record(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def archive_frames(tar_path):
+    """Number of frames of an archive that is neither extracted nor indexed, from its member headers."""
+    with tarfile.open(tar_path, 'r:') as tar:
+        return sum(1 for member in tar if member.isfile() and FRAME_NAME.match(os.path.basename(member.name)))
+
+
+def plan_units(rgb_root, splits, participants=None, video_info_file=None):
+    """Every (split, participant, video) unit under rgb_root with its number of frames, indexed by unit id."""
+    rows = []
+    for split in splits:
+        split_path = os.path.join(rgb_root, split)
+        video_index = VideoIndex(os.path.join(split_path, VIDEO_INDEX_FILE), video_info_file)
+        data_ids = sorted(f for f in os.listdir(split_path)
+                          if f.startswith('P') and os.path.isdir(os.path.join(split_path, f)))
+        for data_id in data_ids:
+            if participants and data_id not in participants:
+                continue
+            data_path = os.path.join(split_path, data_id)
+            for video in list_videos(data_path, archives=True):
+                video_path = os.path.join(data_path, video)
+                if os.path.isdir(video_path) or video_archive(video_path) is not None:
+                    num_frames = int(video_index.update(video, video_path)['num_frames'])
+                else:
+                    num_frames = archive_frames(video_path + '.tar')
+                rows.append((unit_id(split, video), split, data_id, video, num_frames))
+        if video_index.updated:
+            video_index.save()
+    units = pd.DataFrame(rows, columns=['unit', 'split', 'participant', 'video', 'num_frames'])
+    return units.set_index('unit')
+
+
+def assign_shards(units, n_shards):
+    """Shard of every unit: largest videos first, each to the shard with the fewest frames so far."""
+    load = np.zeros(n_shards, dtype=np.int64)
+    shards = pd.Series(0, index=units.index, name='shard')
+    for unit, num_frames in units.num_frames.sort_values(ascending=False, kind='stable').items():
+        shard = int(np.argmin(load))
+        shards[unit] = shard
+        load[shard] += num_frames
+    return shards
+
+
+def create_manifest(run_dir, units, n_shards):
+    """Write manifest.csv of the run unless it exists. Returns the manifest of the run.
+
+    The manifest is created once and then only read, so that units keep their shard when
+    workers are restarted. Concurrent creations are safe: the first one wins.
+    """
+    path = os.path.join(run_dir, MANIFEST_FILE)
+    os.makedirs(run_dir, exist_ok=True)
+    manifest = units.assign(shard=assign_shards(units, n_shards))
+    tmp_path = '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+    manifest.to_csv(tmp_path)
+    try:
+        # link fails if the manifest exists, unlike rename which would replace it
+        os.link(tmp_path, path)
+        print('Planned {} units in {} shards: {}'.format(len(manifest), n_shards, path))
+    except FileExistsError:
+        print('Keeping the existing manifest: {}'.format(path))
+    finally:
+        os.remove(tmp_path)
+    return load_manifest(run_dir)
+
+
+def load_manifest(run_dir):
+    return pd.read_csv(os.path.join(run_dir, MANIFEST_FILE), index_col=0)
+
+
+class UnitLock(object):
+    """Lock file claiming a unit for one worker, on a filesystem shared by all workers.
+
+    The lock is created with O_EXCL, which is atomic on local filesystems and on NFSv3 and later.
+    A held lock is touched every HEARTBEAT seconds; a lock that was not touched for timeout
+    seconds is left from a dead worker and is taken over by the next worker that wants the unit.
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _stale(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.timeout
+        except OSError:
+            return False
+
+    def _break(self):
+        # only one of the workers that found the lock stale manages to move it away
+        stale_path = '{}.{}.{}.stale'.format(self.path, socket.gethostname(), os.getpid())
+        try:
+            os.rename(self.path, stale_path)
+        except OSError:
+            return False
+        if not self._stale(stale_path):
+            # another worker broke the stale lock and took the unit in between, give its lock back
+            try:
+                os.link(stale_path, self.path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+        print('Breaking stale lock {}'.format(self.path))
+        os.remove(stale_path)
+        return True
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._stale(self.path) and self._break():
+                return self.acquire()
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'time': time.time()}, f)
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._touch, daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _touch(self):
+        while not self._stop.wait(HEARTBEAT):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def process_unit(unit, args, video_index, frame_action, store_path):
+    """SLAM and valid frames of one video and, with frame_action, its examples written to store_path.
+
+    Returns (exit code, number of examples). Outputs go to the pos_info directory of the video
+    as with extract_positions_main, whose stage cache lets a rerun skip the finished stages.
+    """
+    video_path = os.path.join(args.rgb_root, unit.split, unit.participant, unit.video)
+    if not os.path.isdir(video_path) and video_archive(video_path) is None:
+        extract_tar(video_path + '.tar', video_path)
+    os.makedirs(os.path.join(video_path, METADATA_PATH), exist_ok=True)
+    video_index.update(unit.video, video_path)
+    video_index.save()
+
+    job = video_job(video_path, METADATA_PATH, unit.video, video_index, fps=args.fps, pacing=args.pacing,
+                    output=args.output, use_cache=not args.no_cache)
+    job['log_path'] = os.path.join(video_path, METADATA_PATH, 'log_{}_{}.txt'.format(job['sub_ns'], job['sub_ne']))
+    status = process_sub_video(**job)
+    if status != 0 or frame_action is None:
+        return status, 0
+
+    valid_frame = pd.read_csv(os.path.join(video_path, METADATA_PATH, 'validFrame.csv'), index_col=0)
+    start_frames, past_pos, future_pos, future_actions = video_examples(valid_frame, unit.video,
+                                                                        video_index.fps(unit.video), frame_action)
+    store = EgoStoreWriter(store_path)
+    store.add_video(unit.video, video_path, start_frames, np.arange(len(start_frames)), past_pos, future_pos,
+                    future_actions)
+    store.close()
+    return 0, len(start_frames)
+
+
+def run_shard(run_dir, manifest, args, shard=None, steal=False):
+    """Process the units of a shard (of all shards if shard is None) that are not done yet.
+
+    A unit is skipped while another worker holds its lock. It is done once its record is
+    written to done/, failures are recorded in failed/ and retried by the next run. With steal,
+    pending units of the other shards are taken once the own shard is finished.
+    Returns {unit: exit code} of the units processed.
+    """
+    units = manifest if shard is None else manifest[manifest['shard'] == shard]
+    if steal and shard is not None:
+        units = pd.concat([units, manifest[manifest['shard'] != shard]])
+    frame_action = FrameAction.load(args.fav) if args.fav else None
+    video_indexes = {}
+    exit_codes = {}
+    for n, (unit, row) in enumerate(units.iterrows()):
+        if os.path.isfile(done_path(run_dir, unit)):
+            continue
+        lock = UnitLock(lock_path(run_dir, unit), args.lock_timeout)
+        if not lock.acquire():
+            print('{} is locked by another worker'.format(unit))
+            continue
+        try:
+            # another worker may have finished the unit since it was checked
+            if os.path.isfile(done_path(run_dir, unit)):
+                continue
+            print('\n{} ({} of {}): {} frames'.format(unit, n + 1, len(units), row.num_frames))
+            if row.split not in video_indexes:
+                video_indexes[row.split] = VideoIndex(os.path.join(args.rgb_root, row.split, VIDEO_INDEX_FILE),
+                                                      args.video_info)
+            worker_shard = row['shard'] if shard is None else shard
+            store_path = os.path.join(run_dir, 'examples', 'shard_{}'.format(worker_shard), unit)
+            start = time.time()
+            try:
+                status, n_examples = process_unit(row, args, video_indexes[row.split], frame_action, store_path)
+            except Exception as e:
+                print('{} failed: {!r}'.format(unit, e))
+                status, n_examples = 1, 0
+            record = {'unit': unit, 'status': status, 'host': socket.gethostname(), 'pid': os.getpid(),
+                      'shard': int(worker_shard), 'seconds': time.time() - start, 'examples': n_examples,
+                      'store': os.path.relpath(store_path, run_dir) if status == 0 and frame_action else None,
+                      'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+            if status == 0:
+                write_record(done_path(run_dir, unit), record)
+                if os.path.isfile(failed_path(run_dir, unit)):
+                    os.remove(failed_path(run_dir, unit))
+            else:
+                write_record(failed_path(run_dir, unit), record)
+            exit_codes[unit] = status
+            print('{} finished with exit code {} in {:.0f} s'.format(unit, status, record['seconds']))
+        finally:
+            lock.release()
+    return exit_codes
+
+
+def merge_examples(run_dir, manifest, split, save_root, partial=False):
+    """Write the EgoStore_<participant> of every participant of a split to save_root from the unit stores.
+
+    Participants and their videos are taken in sorted order and data ids are numbered on across
+    participants, which gives the stores extract_examples writes for the whole split.
+    Without partial, all units of the split must be done with examples. Returns the number of examples.
+    """
+    units = manifest[manifest['split'] == split].sort_values(['participant', 'video'])
+    records = {unit: read_record(done_path(run_dir, unit)) for unit in units.index}
+    missing = [unit for unit, record in records.items() if record is None or record['store'] is None]
+    if missing:
+        print('{} unit(s) without examples: '.format(len(missing)), missing)
+        if not partial:
+            raise RuntimeError('Units of {} are not done, rerun them or merge with --partial'.format(split))
+
+    os.makedirs(save_root, exist_ok=True)
+    total_examples = 0
+    for participant, group in units.groupby('participant', sort=True):
+        store = EgoStoreWriter(os.path.join(save_root, 'EgoStore_{}'.format(participant)))
+        for unit in group.index:
+            if unit in missing:
+                continue
+            unit_store = EgoStore(os.path.join(run_dir, records[unit]['store']))
+            store.add_store(unit_store, total_examples)
+            total_examples += len(unit_store)
+        store.close()
+        print('{}: {} examples, total {}'.format(participant, len(store), total_examples))
+    return total_examples
+
+
+def print_status(run_dir, manifest):
+    """Done, failed, locked and pending units of every shard."""
+    status = pd.DataFrame(index=manifest.index)
+    status['shard'] = manifest['shard']
+    status['done'] = [os.path.isfile(done_path(run_dir, unit)) for unit in manifest.index]
+    status['failed'] = [os.path.isfile(failed_path(run_dir, unit)) for unit in manifest.index]
+    status['locked'] = [os.path.isfile(lock_path(run_dir, unit)) for unit in manifest.index]
+    status['pending'] = ~status.done & ~status.locked
+    status['frames'] = manifest.num_frames.where(~status.done, 0)
+    table = status.groupby('shard')[['done', 'failed', 'locked', 'pending', 'frames']].sum()
+    table.loc['all'] = table.sum()
+    table.columns = ['done', 'failed', 'locked', 'pending', 'frames left']
+    print(table.to_string())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sharded, resumable extraction of the whole dataset. "
+                                                 "plan lists every video once and assigns it to a shard, run processes "
+                                                 "the videos of a shard (start one worker per shard, on any machine "
+                                                 "sharing run_dir and the data, from the repository directory), "
+                                                 "merge writes the EgoStore of every participant, status shows progress.")
+    parser.add_argument("command", choices=['plan', 'run', 'merge', 'status'])
+    parser.add_argument("--run_dir", required=True, help="directory of the run on the shared filesystem")
+    parser.add_argument("--splits", nargs='+', default=['train'], help="plan: splits to process")
+    parser.add_argument("--participants", nargs='+', help="plan: only these participants (PXX)")
+    parser.add_argument("--shards", default=1, type=int, help="plan: number of shards")
+    parser.add_argument("--shard", type=int, help="run: shard to process, all shards by default")
+    parser.add_argument("--steal", help="run: then take pending units of other shards", action="store_true")
+    parser.add_argument("--fav", help="run: frame_action.npz of extract_examples --make_fav, to build the examples")
+    parser.add_argument("--fps", default=60, type=float, help="run: sample frames with fps")
+    parser.add_argument("--pacing", default="fast", help="run: frame pacing of extract_mono_epic")
+    parser.add_argument("--output", default="text", help="run: output files of extract_mono_epic")
+    parser.add_argument("--no_cache", help="run: rerun all stages of a video", action="store_true")
+    parser.add_argument("--lock_timeout", default=LOCK_TIMEOUT, type=float,
+                        help="run: seconds after which the lock of a dead worker is taken over")
+    parser.add_argument("--split", default='train', help="merge: split to merge")
+    parser.add_argument("--save_root", help="merge: directory of the EgoStore_PXX outputs")
+    parser.add_argument("--partial", help="merge: leave out the units that are not done", action="store_true")
+    parser.add_argument("--video_info", help="EPIC_video_info.csv (default: <annotations_root>/EPIC_video_info.csv)")
+    add_root_arguments(parser)
+    args = resolve_roots(parser.parse_args())
+    if args.video_info is None:
+        args.video_info = os.path.join(args.annotations_root, 'EPIC_video_info.csv')
+
+    if args.command == 'plan':
+        if os.path.isfile(os.path.join(args.run_dir, MANIFEST_FILE)):
+            print('Keeping the existing manifest: {}'.format(os.path.join(args.run_dir, MANIFEST_FILE)))
+            manifest = load_manifest(args.run_dir)
+        else:
+            manifest = create_manifest(args.run_dir, plan_units(args.rgb_root, args.splits, args.participants,
+                                                                args.video_info), args.shards)
+        print_status(args.run_dir, manifest)
+    elif args.command == 'run':
+        exit_codes = run_shard(args.run_dir, load_manifest(args.run_dir), args, args.shard, args.steal)
+        failed = [unit for unit, ret in exit_codes.items() if ret != 0]
+        print('Finished {} of {} units. Failed: '.format(len(exit_codes) - len(failed), len(exit_codes)), failed)
+    elif args.command == 'merge':
+        if args.save_root is None:
+            parser.error('merge needs --save_root')
+        merge_examples(args.run_dir, load_manifest(args.run_dir), args.split, args.save_root, args.partial)
+    else:
+        print_status(args.run_dir, load_manifest(args.run_dir))
@@ -0,0 +1,150 @@
+/**
+* This file is part of ORB-SLAM2.
+*
+* Copyright (C) 2014-2016 Raúl Mur-Artal <raulmur at unizar dot es> (University of Zaragoza)
+* For more information see <https://github.com/raulmur/ORB_SLAM2>
+*
+* ORB-SLAM2 is free software: you can redistribute it and/or modify
+* it under the terms of the GNU General Public License as published by
+* the Free Software Foundation, either version 3 of the License, or
+* (at your option) any later version.
+*
+* ORB-SLAM2 is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with ORB-SLAM2. If not, see <http://www.gnu.org/licenses/>.
+*/
+
+
+#include "ImagePrefetcher.h"
+
+#include <chrono>
+#include <cstdlib>
+#include <algorithm>
+#include <fcntl.h>
+#include <unistd.h>
+#include <opencv2/highgui/highgui.hpp>
+
+namespace ORB_SLAM2
+{
+
+ImagePrefetcher::ImagePrefetcher(const std::vector<std::string> &vstrFilenames, const int flags, const int nQueueDepth,
+                                 const int nThreads):
+    mvstrFilenames(vstrFilenames), mFlags(flags), mnQueueDepth(std::max(nQueueDepth,1)), mnNext(0), mnConsumed(0),
+    mbFinish(false), mStallTime(0)
+{
+    for(int i=0; i<std::max(nThreads,1); i++)
+        mvThreads.push_back(std::thread(&ImagePrefetcher::Run,this));
+}
+
+ImagePrefetcher::~ImagePrefetcher()
+{
+    {
+        std::unique_lock<std::mutex> lock(mMutexQueue);
+        mbFinish = true;
+    }
+    mCondFree.notify_all();
+    for(size_t i=0; i<mvThreads.size(); i++)
+        mvThreads[i].join();
+
+    for(std::map<std::string, int>::iterator mit=mmArchives.begin(); mit!=mmArchives.end(); mit++)
+        if(mit->second>=0)
+            close(mit->second);
+}
+
+void ImagePrefetcher::Run()
+{
+    while(1)
+    {
+        size_t ni;
+        {
+            std::unique_lock<std::mutex> lock(mMutexQueue);
+            while(!mbFinish && mnNext<mvstrFilenames.size() && mnNext>=mnConsumed+mnQueueDepth)
+                mCondFree.wait(lock);
+            if(mbFinish || mnNext>=mvstrFilenames.size())
+                return;
+            ni = mnNext++;
+        }
+
+        cv::Mat im = LoadImage(mvstrFilenames[ni]);
+
+        {
+            std::unique_lock<std::mutex> lock(mMutexQueue);
+            mmReady[ni] = im;
+        }
+        mCondReady.notify_all();
+    }
+}
+
+cv::Mat ImagePrefetcher::LoadImage(const std::string &strFilename)
+{
+    const size_t at = strFilename.rfind('@');
+    const size_t colon = strFilename.rfind(':');
+    if(at==std::string::npos || colon==std::string::npos || colon<at)
+        return cv::imread(strFilename,mFlags);
+
+    const std::string strArchive = strFilename.substr(0,at);
+    const off_t offset = std::strtoll(strFilename.c_str()+at+1,NULL,10);
+    const size_t size = std::strtoull(strFilename.c_str()+colon+1,NULL,10);
+
+    int fd = GetArchive(strArchive);
+    if(fd<0)
+        return cv::Mat();
+
+    // pread does not move a shared file offset, so all loader threads can use the same descriptor
+    std::vector<uchar> buffer(size);
+    size_t nRead = 0;
+    while(nRead<size)
+    {
+        ssize_t n = pread(fd,&buffer[nRead],size-nRead,offset+nRead);
+        if(n<=0)
+            return cv::Mat();
+        nRead += n;
+    }
+    return cv::imdecode(buffer,mFlags);
+}
+
+int ImagePrefetcher::GetArchive(const std::string &strArchive)
+{
+    std::unique_lock<std::mutex> lock(mMutexArchives);
+    std::map<std::string, int>::iterator mit = mmArchives.find(strArchive);
+    if(mit!=mmArchives.end())
+        return mit->second;
+    int fd = open(strArchive.c_str(),O_RDONLY);
+    mmArchives[strArchive] = fd;
+    return fd;
+}
+
+cv::Mat ImagePrefetcher::Get(const size_t ni)
+{
+    if(ni>=mvstrFilenames.size())
+        return cv::Mat();
+
+    std::chrono::steady_clock::time_point t1 = std::chrono::steady_clock::now();
+
+    std::unique_lock<std::mutex> lock(mMutexQueue);
+    while(!mmReady.count(ni))
+        mCondReady.wait(lock);
+
+    cv::Mat im = mmReady[ni];
+    mmReady.erase(mmReady.begin(),mmReady.upper_bound(ni));
+    mnConsumed = ni+1;
+
+    std::chrono::steady_clock::time_point t2 = std::chrono::steady_clock::now();
+    mStallTime += std::chrono::duration_cast<std::chrono::duration<double> >(t2 - t1).count();
+
+    lock.unlock();
+    mCondFree.notify_all();
+    return im;
+}
+
+double ImagePrefetcher::GetStallTime()
+{
+    std::unique_lock<std::mutex> lock(mMutexQueue);
+    return mStallTime;
+}
+
+} //namespace ORB_SLAM
@@ -408,9 +408,10 @@ static int bit_pattern_31_[256*4] =
 };
 
 ORBextractor::ORBextractor(int _nfeatures, float _scaleFactor, int _nlevels,
-         int _iniThFAST, int _minThFAST):
+         int _iniThFAST, int _minThFAST, int _nThreads):
     nfeatures(_nfeatures), scaleFactor(_scaleFactor), nlevels(_nlevels),
-    iniThFAST(_iniThFAST), minThFAST(_minThFAST)
+    iniThFAST(_iniThFAST), minThFAST(_minThFAST), nthreads(max(1, min(_nThreads, _nlevels))),
+    mnImage(0), mnNextLevel(0), mnLevelsDone(0), mbFinish(false), mpvLevelKeypoints(NULL), mpvLevelDescriptors(NULL)
 {
     mvScaleFactor.resize(nlevels);
     mvLevelSigma2.resize(nlevels);
@@ -467,6 +468,50 @@ ORBextractor::ORBextractor(int _nfeatures, float _scaleFactor, int _nlevels,
         umax[v] = v0;
         ++v0;
     }
+
+    for(int i=1; i<nthreads; i++)
+        mvThreads.push_back(thread(&ORBextractor::RunWorker, this));
+}
+
+ORBextractor::~ORBextractor()
+{
+    {
+        unique_lock<mutex> lock(mMutexPool);
+        mbFinish = true;
+    }
+    mCondWork.notify_all();
+    for(size_t i=0; i<mvThreads.size(); i++)
+        mvThreads[i].join();
+}
+
+void ORBextractor::RunWorker()
+{
+    unsigned long nLastImage = 0;
+    unique_lock<mutex> lock(mMutexPool);
+    while(true)
+    {
+        mCondWork.wait(lock, [&]{return mbFinish || mnImage != nLastImage;});
+        if(mbFinish)
+            return;
+        nLastImage = mnImage;
+        while(ExtractNextLevel(lock));
+    }
+}
+
+bool ORBextractor::ExtractNextLevel(unique_lock<mutex> &lock)
+{
+    if(mnNextLevel >= nlevels)
+        return false;
+    const int level = mnNextLevel++;
+
+    // Every level writes only to its own slots, the results don't depend on which thread runs it
+    lock.unlock();
+    ExtractLevel(level, (*mpvLevelKeypoints)[level], (*mpvLevelDescriptors)[level]);
+    lock.lock();
+
+    if(++mnLevelsDone == nlevels)
+        mCondDone.notify_all();
+    return true;
 }
 
 static void computeOrientation(const Mat& image, vector<KeyPoint>& keypoints, const vector<int>& umax)
@@ -766,90 +811,91 @@ void ORBextractor::ComputeKeyPointsOctTree(vector<vector<KeyPoint> >& allKeypoin
 {
     allKeypoints.resize(nlevels);
 
+    for (int level = 0; level < nlevels; ++level)
+        ComputeKeyPointsLevel(level, allKeypoints[level]);
+}
+
+void ORBextractor::ComputeKeyPointsLevel(const int level, vector<KeyPoint>& keypoints)
+{
     const float W = 30;
 
-    for (int level = 0; level < nlevels; ++level)
-    {
-        const int minBorderX = EDGE_THRESHOLD-3;
-        const int minBorderY = minBorderX;
-        const int maxBorderX = mvImagePyramid[level].cols-EDGE_THRESHOLD+3;
-        const int maxBorderY = mvImagePyramid[level].rows-EDGE_THRESHOLD+3;
+    const int minBorderX = EDGE_THRESHOLD-3;
+    const int minBorderY = minBorderX;
+    const int maxBorderX = mvImagePyramid[level].cols-EDGE_THRESHOLD+3;
+    const int maxBorderY = mvImagePyramid[level].rows-EDGE_THRESHOLD+3;
 
-        vector<cv::KeyPoint> vToDistributeKeys;
-        vToDistributeKeys.reserve(nfeatures*10);
+    vector<cv::KeyPoint> vToDistributeKeys;
+    vToDistributeKeys.reserve(nfeatures*10);
 
-        const float width = (maxBorderX-minBorderX);
-        const float height = (maxBorderY-minBorderY);
+    const float width = (maxBorderX-minBorderX);
+    const float height = (maxBorderY-minBorderY);
 
-        const int nCols = width/W;
-        const int nRows = height/W;
-        const int wCell = ceil(width/nCols);
-        const int hCell = ceil(height/nRows);
+    const int nCols = width/W;
+    const int nRows = height/W;
+    const int wCell = ceil(width/nCols);
+    const int hCell = ceil(height/nRows);
 
-        for(int i=0; i<nRows; i++)
-        {
-            const float iniY =minBorderY+i*hCell;
-            float maxY = iniY+hCell+6;
+    for(int i=0; i<nRows; i++)
+    {
+        const float iniY =minBorderY+i*hCell;
+        float maxY = iniY+hCell+6;
+
+        if(iniY>=maxBorderY-3)
+            continue;
+        if(maxY>maxBorderY)
+            maxY = maxBorderY;
 
-            if(iniY>=maxBorderY-3)
+        for(int j=0; j<nCols; j++)
+        {
+            const float iniX =minBorderX+j*wCell;
+            float maxX = iniX+wCell+6;
+            if(iniX>=maxBorderX-6)
                 continue;
-            if(maxY>maxBorderY)
-                maxY = maxBorderY;
+            if(maxX>maxBorderX)
+                maxX = maxBorderX;
 
-            for(int j=0; j<nCols; j++)
-            {
-                const float iniX =minBorderX+j*wCell;
-                float maxX = iniX+wCell+6;
-                if(iniX>=maxBorderX-6)
-                    continue;
-                if(maxX>maxBorderX)
-                    maxX = maxBorderX;
+            vector<cv::KeyPoint> vKeysCell;
+            FAST(mvImagePyramid[level].rowRange(iniY,maxY).colRange(iniX,maxX),
+                 vKeysCell,iniThFAST,true);
 
-                vector<cv::KeyPoint> vKeysCell;
+            if(vKeysCell.empty())
+            {
                 FAST(mvImagePyramid[level].rowRange(iniY,maxY).colRange(iniX,maxX),
-                     vKeysCell,iniThFAST,true);
-
-                if(vKeysCell.empty())
-                {
-                    FAST(mvImagePyramid[level].rowRange(iniY,maxY).colRange(iniX,maxX),
-                         vKeysCell,minThFAST,true);
-                }
+                     vKeysCell,minThFAST,true);
+            }
 
-                if(!vKeysCell.empty())
+            if(!vKeysCell.empty())
+            {
+                for(vector<cv::KeyPoint>::iterator vit=vKeysCell.begin(); vit!=vKeysCell.end();vit++)
                 {
-                    for(vector<cv::KeyPoint>::iterator vit=vKeysCell.begin(); vit!=vKeysCell.end();vit++)
-                    {
-                        (*vit).pt.x+=j*wCell;
-                        (*vit).pt.y+=i*hCell;
-                        vToDistributeKeys.push_back(*vit);
-                    }
+                    (*vit).pt.x+=j*wCell;
+                    (*vit).pt.y+=i*hCell;
+                    vToDistributeKeys.push_back(*vit);
                 }
-
             }
+
         }
+    }
 
-        vector<KeyPoint> & keypoints = allKeypoints[level];
-        keypoints.reserve(nfeatures);
+    keypoints.reserve(nfeatures);
 
-        keypoints = DistributeOctTree(vToDistributeKeys, minBorderX, maxBorderX,
-                                      minBorderY, maxBorderY,mnFeaturesPerLevel[level], level);
+    keypoints = DistributeOctTree(vToDistributeKeys, minBorderX, maxBorderX,
+                                  minBorderY, maxBorderY,mnFeaturesPerLevel[level], level);
 
-        const int scaledPatchSize = PATCH_SIZE*mvScaleFactor[level];
+    const int scaledPatchSize = PATCH_SIZE*mvScaleFactor[level];
 
-        // Add border to coordinates and scale information
-        const int nkps = keypoints.size();
-        for(int i=0; i<nkps ; i++)
-        {
-            keypoints[i].pt.x+=minBorderX;
-            keypoints[i].pt.y+=minBorderY;
-            keypoints[i].octave=level;
-            keypoints[i].size = scaledPatchSize;
-        }
+    // Add border to coordinates and scale information
+    const int nkps = keypoints.size();
+    for(int i=0; i<nkps ; i++)
+    {
+        keypoints[i].pt.x+=minBorderX;
+        keypoints[i].pt.y+=minBorderY;
+        keypoints[i].octave=level;
+        keypoints[i].size = scaledPatchSize;
     }
 
     // compute orientations
-    for (int level = 0; level < nlevels; ++level)
-        computeOrientation(mvImagePyramid[level], allKeypoints[level], umax);
+    computeOrientation(mvImagePyramid[level], keypoints, umax);
 }
 
 void ORBextractor::ComputeKeyPointsOld(std::vector<std::vector<KeyPoint> > &allKeypoints)
@@ -1052,22 +1098,37 @@ void ORBextractor::operator()( InputArray _image, InputArray _mask, vector<KeyPo
     // Pre-compute the scale pyramid
     ComputePyramid(image);
 
-    vector < vector<KeyPoint> > allKeypoints;
-    ComputeKeyPointsOctTree(allKeypoints);
-    //ComputeKeyPointsOld(allKeypoints);
-
-    Mat descriptors;
+    // Extract every level, on the thread pool if there is one
+    vector < vector<KeyPoint> > allKeypoints(nlevels);
+    vector<Mat> allDescriptors(nlevels);
+    if(mvThreads.empty())
+    {
+        for (int level = 0; level < nlevels; ++level)
+            ExtractLevel(level, allKeypoints[level], allDescriptors[level]);
+    }
+    else
+    {
+        unique_lock<mutex> lock(mMutexPool);
+        mpvLevelKeypoints = &allKeypoints;
+        mpvLevelDescriptors = &allDescriptors;
+        mnNextLevel = 0;
+        mnLevelsDone = 0;
+        mnImage++;
+        mCondWork.notify_all();
+        while(ExtractNextLevel(lock));
+        mCondDone.wait(lock, [&]{return mnLevelsDone == nlevels;});
+        mpvLevelKeypoints = NULL;
+        mpvLevelDescriptors = NULL;
+    }
 
+    // Gather the levels in order
     int nkeypoints = 0;
     for (int level = 0; level < nlevels; ++level)
         nkeypoints += (int)allKeypoints[level].size();
     if( nkeypoints == 0 )
         _descriptors.release();
     else
-    {
         _descriptors.create(nkeypoints, 32, CV_8U);
-        descriptors = _descriptors.getMat();
-    }
 
     _keypoints.clear();
     _keypoints.reserve(nkeypoints);
@@ -1081,29 +1142,37 @@ void ORBextractor::operator()( InputArray _image, InputArray _mask, vector<KeyPo
         if(nkeypointsLevel==0)
             continue;
 
-        // preprocess the resized image
-        Mat workingMat = mvImagePyramid[level].clone();
-        GaussianBlur(workingMat, workingMat, Size(7, 7), 2, 2, BORDER_REFLECT_101);
-
-        // Compute the descriptors
-        Mat desc = descriptors.rowRange(offset, offset + nkeypointsLevel);
-        computeDescriptors(workingMat, keypoints, desc, pattern);
-
+        allDescriptors[level].copyTo(_descriptors.getMat().rowRange(offset, offset + nkeypointsLevel));
         offset += nkeypointsLevel;
 
-        // Scale keypoint coordinates
-        if (level != 0)
-        {
-            float scale = mvScaleFactor[level]; //getScale(level, firstLevel, scaleFactor);
-            for (vector<KeyPoint>::iterator keypoint = keypoints.begin(),
-                 keypointEnd = keypoints.end(); keypoint != keypointEnd; ++keypoint)
-                keypoint->pt *= scale;
-        }
-        // And add the keypoints to the output
         _keypoints.insert(_keypoints.end(), keypoints.begin(), keypoints.end());
     }
 }
 
+void ORBextractor::ExtractLevel(const int level, vector<KeyPoint>& keypoints, Mat& descriptors)
+{
+    ComputeKeyPointsLevel(level, keypoints);
+
+    if(keypoints.empty())
+        return;
+
+    // preprocess the resized image
+    Mat workingMat = mvImagePyramid[level].clone();
+    GaussianBlur(workingMat, workingMat, Size(7, 7), 2, 2, BORDER_REFLECT_101);
+
+    // Compute the descriptors
+    computeDescriptors(workingMat, keypoints, descriptors, pattern);
+
+    // Scale keypoint coordinates
+    if (level != 0)
+    {
+        float scale = mvScaleFactor[level]; //getScale(level, firstLevel, scaleFactor);
+        for (vector<KeyPoint>::iterator keypoint = keypoints.begin(),
+             keypointEnd = keypoints.end(); keypoint != keypointEnd; ++keypoint)
+            keypoint->pt *= scale;
+    }
+}
+
 void ORBextractor::ComputePyramid(cv::Mat image)
 {
     for (int level = 0; level < nlevels; ++level)
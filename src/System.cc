@@ -25,6 +25,7 @@
 #include <thread>
 #include <pangolin/pangolin.h>
 #include <iomanip>
+#include <unistd.h>
 
 namespace ORB_SLAM2
 {
@@ -62,7 +63,21 @@ System::System(const string &strVocFile, const string &strSettingsFile, const eS
     cout << endl << "Loading ORB Vocabulary. This could take a while..." << endl;
 
     mpVocabulary = new ORBVocabulary();
-    bool bVocLoad = mpVocabulary->loadFromTextFile(strVocFile);
+    bool bVocLoad = false;
+    // Prefer the binary vocabulary (see tools/bin_vocabulary) when it is next to the text one
+    const bool bBinVocGiven = strVocFile.size()>4 && strVocFile.compare(strVocFile.size()-4,4,".bin")==0;
+    string strBinVocFile = strVocFile;
+    if(strBinVocFile.size()>4 && strBinVocFile.compare(strBinVocFile.size()-4,4,".txt")==0)
+        strBinVocFile.replace(strBinVocFile.size()-4,4,".bin");
+    if(strBinVocFile.size()>4 && strBinVocFile.compare(strBinVocFile.size()-4,4,".bin")==0 &&
+       access(strBinVocFile.c_str(),R_OK)==0)
+    {
+        cout << "Using binary vocabulary: " << strBinVocFile << endl;
+        bVocLoad = mpVocabulary->loadFromBinaryFile(strBinVocFile);
+    }
+    // Any other path, or a text vocabulary whose binary version is missing or unreadable, is loaded as text
+    if(!bVocLoad && !bBinVocGiven)
+        bVocLoad = mpVocabulary->loadFromTextFile(strVocFile);
     if(!bVocLoad)
     {
         cerr << "Wrong path to vocabulary. " << endl;
@@ -292,6 +307,29 @@ bool System::MapChanged()
         return false;
 }
 
+bool System::LocalMappingIdle()
+{
+    return mpLocalMapper->KeyframesInQueue()==0 && mpLocalMapper->AcceptKeyFrames();
+}
+
+void System::WaitForMapping()
+{
+    while(!LocalMappingIdle() || mpLoopCloser->KeyframesInQueue()>0 || mpLoopCloser->isRunningGBA())
+    {
+        usleep(5000);
+    }
+}
+
+int System::LocalMappingQueueSize()
+{
+    return mpLocalMapper->KeyframesInQueue();
+}
+
+int System::LoopClosingQueueSize()
+{
+    return mpLoopCloser->KeyframesInQueue();
+}
+
 void System::Reset()
 {
     unique_lock<mutex> lock(mMutexReset);
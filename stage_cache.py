@@ -0,0 +1,118 @@
+import os
+import json
+import socket
+import hashlib
+
+
+MANIFEST_VERSION = 1
+
+# sha1 of files already hashed by this process, keyed on (path, size, mtime)
+_hashes = {}
+
+
+def file_signature(path):
+    """Content hash of a file, or of the modification time of a directory.
+
+    A file is only read again when its size or mtime changed since it was last hashed.
+    Returns None if the path doesn't exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if os.path.isdir(path):
+        # files added to or removed from a directory change its mtime
+        return 'dir:{}'.format(st.st_mtime_ns)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        _hashes[key] = sha1.hexdigest()
+    return _hashes[key]
+
+
+def stat_signature(path):
+    """[size, mtime] of a file that is too large to hash on every run, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class StageCache(object):
+    """Manifest of the pipeline stages computed into one directory.
+
+    Every stage (image list, SLAM, valid frames, examples) is recorded with a key hashed from
+    the signatures of its input files and its parameters. A stage is fresh, i.e. can be skipped,
+    when its key is unchanged and all its outputs exist. Since outputs of a stage are inputs of
+    the next one, changing e.g. config.yaml reruns SLAM and, only if the trajectory changed,
+    the stages after it.
+
+    The manifest is a json file rewritten atomically after every update. Several processes can
+    share one manifest: the stages they changed are merged into the ones saved meanwhile by the
+    others, and a stage lost to a concurrent write is only computed again. With enabled=False
+    no stage is fresh, but updates are still recorded.
+    """
+
+    def __init__(self, manifest_path, enabled=True):
+        self.manifest_path = manifest_path
+        self.enabled = enabled
+        self.stages = self._read()
+        # stages changed by this process since the last write, None for invalidated ones
+        self.updated = {}
+
+    def _read(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except ValueError:
+            print('Ignoring corrupt cache manifest: {}'.format(self.manifest_path))
+            return {}
+        return manifest['stages'] if manifest.get('version') == MANIFEST_VERSION else {}
+
+    @staticmethod
+    def key(inputs, params):
+        signatures = [(os.path.abspath(path), file_signature(path)) for path in inputs]
+        if any(signature is None for _, signature in signatures):
+            return None
+        text = json.dumps({'inputs': signatures, 'params': params}, sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def fresh(self, stage, inputs, params, outputs):
+        if not self.enabled or stage not in self.stages:
+            return False
+        if not all(os.path.exists(path) for path in outputs):
+            return False
+        key = self.key(inputs, params)
+        return key is not None and key == self.stages[stage]['key']
+
+    def update(self, stage, inputs, params, outputs):
+        self.stages[stage] = {'key': self.key(inputs, params), 'params': params,
+                              'inputs': [os.path.abspath(path) for path in inputs],
+                              'outputs': [os.path.abspath(path) for path in outputs]}
+        self.updated[stage] = self.stages[stage]
+        self._write()
+
+    def invalidate(self, stage):
+        if self.stages.pop(stage, None) is not None:
+            self.updated[stage] = None
+            self._write()
+
+    def _write(self):
+        stages = self._read()
+        for stage, entry in self.updated.items():
+            if entry is None:
+                stages.pop(stage, None)
+            else:
+                stages[stage] = entry
+        tmp_path = '{}.{}.{}.tmp'.format(self.manifest_path, socket.gethostname(), os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'stages': stages}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self.stages = stages
+        self.updated = {}
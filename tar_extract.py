@@ -0,0 +1,138 @@
+import os
+import shutil
+import tarfile
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+BUFFER_SIZE = 1 << 20
+
+
+def index_dtype(name_length):
+    """Dtype of an archive index whose member names have at most name_length characters."""
+    return np.dtype([('name', 'U{}'.format(max(name_length, 1))), ('offset', np.int64), ('size', np.int64)])
+
+
+def tar_dir(tar_path):
+    """Directory a video archive is extracted to, e.g. P01/P01_01.tar -> P01/P01_01."""
+    data_path, file = os.path.split(tar_path)
+    return os.path.join(data_path, file.split('.')[0])
+
+
+def index_path(tar_path):
+    return tar_path + '.index.npy'
+
+
+def is_indexed(tar_path):
+    return os.path.isfile(index_path(tar_path))
+
+
+def _member_path(out_dir, member):
+    out_dir = os.path.normpath(out_dir)
+    path = os.path.normpath(os.path.join(out_dir, member.name))
+    if os.path.isabs(member.name) or not (path == out_dir or path.startswith(os.path.join(out_dir, ''))):
+        raise IOError('Unsafe path in archive: {}'.format(member.name))
+    return path
+
+
+def extract_tar(tar_path, out_dir, remove=True, buffer_size=BUFFER_SIZE):
+    """Extract an uncompressed tar member by member.
+
+    Every file is written through a large buffer to a temporary name and renamed when complete,
+    so files of an interrupted run are either whole or missing. Files that already exist with
+    the size of their member are not written again, which makes a rerun resume where the
+    previous one stopped. The archive is removed only after all its files are verified, together
+    with its index, if any, so that the video is no longer read from the archive.
+    Returns (number of files, number of files written).
+    """
+    members = []
+    n_written = 0
+    made_dirs = set()
+    with tarfile.open(tar_path, 'r:') as tar:
+        for member in tar:
+            path = _member_path(out_dir, member)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            if not member.isfile():
+                tar.extract(member, out_dir)
+                continue
+            members.append((path, member.size))
+            if os.path.isfile(path) and os.path.getsize(path) == member.size:
+                continue
+            parent = os.path.dirname(path)
+            if parent not in made_dirs:
+                os.makedirs(parent, exist_ok=True)
+                made_dirs.add(parent)
+            tmp_path = path + '.part'
+            with tar.extractfile(member) as src, open(tmp_path, 'wb', buffering=buffer_size) as dst:
+                shutil.copyfileobj(src, dst, buffer_size)
+            os.replace(tmp_path, path)
+            n_written += 1
+
+    for path, size in members:
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            raise IOError('Extracted file {} of {} is missing or incomplete'.format(path, tar_path))
+    if remove:
+        if is_indexed(tar_path):
+            os.remove(index_path(tar_path))
+        os.remove(tar_path)
+    return len(members), n_written
+
+
+def index_tar(tar_path):
+    """Write the (name, offset, size) of every file of an uncompressed tar next to it.
+
+    Offsets are those of the file data, which can then be read from the archive without
+    extracting it.
+    """
+    with tarfile.open(tar_path, 'r:') as tar:
+        members = [(member.name, member.offset_data, member.size) for member in tar if member.isfile()]
+    # the name field fits the longest name, numpy would silently truncate longer ones
+    index = np.array(members, dtype=index_dtype(max([len(name) for name, _, _ in members] or [0])))
+    tmp_path = index_path(tar_path) + '.tmp.npy'
+    np.save(tmp_path, index)
+    os.replace(tmp_path, index_path(tar_path))
+    return index
+
+
+def _process_tar(tar_path, index, remove):
+    try:
+        if index:
+            n_files = len(index_tar(tar_path))
+            print('index {}: {} files'.format(tar_path, n_files))
+        else:
+            n_files, n_written = extract_tar(tar_path, tar_dir(tar_path), remove)
+            print('unzip {}: {} files, {} written{}'.format(tar_path, n_files, n_written,
+                                                            ' and remove it.' if remove else ''))
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+def unzip_tars(data_paths, n_workers=1, remove=True, skip_indexed=False, index=False):
+    """Extract (or with index=True, only index) the .tar files of every directory in data_paths.
+
+    Archives are spread over n_workers processes, largest first. With skip_indexed, archives
+    that already have an index are left as they are. Returns the list of failed archives.
+    """
+    tar_paths = []
+    for data_path in data_paths:
+        to_unzip_file = [f for f in os.listdir(data_path) if f.endswith('.tar')]
+        if skip_indexed:
+            to_unzip_file = [f for f in to_unzip_file if not is_indexed(os.path.join(data_path, f))]
+        print('{}: {} file(s) to be {}'.format(data_path, len(to_unzip_file), 'indexed' if index else 'unzipped'))
+        tar_paths += [os.path.join(data_path, f) for f in to_unzip_file]
+    tar_paths.sort(key=os.path.getsize, reverse=True)
+
+    if n_workers <= 1:
+        status = [_process_tar(tar_path, index, remove) for tar_path in tar_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            status = list(pool.map(_process_tar, tar_paths, [index] * len(tar_paths), [remove] * len(tar_paths)))
+    failed = [tar_path for tar_path, ret in zip(tar_paths, status) if ret != 0]
+    if failed:
+        print('Failed to process {} file(s): '.format(len(failed)), failed)
+    return failed
@@ -0,0 +1,88 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+
+TELEMETRY_SUFFIX = '_telemetry.csv'
+TELEMETRY_SUMMARY_FILE = 'telemetry_summary.csv'
+
+# tracking states of ORB_SLAM2::Tracking
+NOT_INITIALIZED = 1
+LOST = 3
+
+PERCENTILES = [50, 90, 99]
+
+
+def telemetry_path(prefix):
+    """Per frame telemetry written by extract_mono_epic for the sequence saved to prefix."""
+    return prefix + TELEMETRY_SUFFIX
+
+
+def read_telemetry(path):
+    return pd.read_csv(path, index_col=0)
+
+
+def summarize(telemetry):
+    """Latency percentiles, lost ratios and queue depths of the frames of one or more sequences.
+
+    Times are wall-clock seconds. frames_per_sec is the tracking throughput including the
+    image and pacing waits.
+    """
+    n = len(telemetry)
+    summary = {'frames': n}
+    if n == 0:
+        return summary
+    state = telemetry.state.values
+    summary['lost_ratio'] = np.mean(state == LOST)
+    summary['not_initialized_ratio'] = np.mean(state == NOT_INITIALIZED)
+    track_time = telemetry.track_time.values
+    for p, value in zip(PERCENTILES, np.percentile(track_time, PERCENTILES)):
+        summary['track_time_p{}'.format(p)] = value
+    summary['track_time_max'] = track_time.max()
+    summary['image_wait_p99'] = np.percentile(telemetry.image_wait.values, 99)
+    summary['image_wait_total'] = telemetry.image_wait.sum()
+    summary['pacing_wait_total'] = telemetry.pacing_wait.sum()
+    summary['frames_per_sec'] = n / (track_time.sum() + summary['image_wait_total'] + summary['pacing_wait_total'])
+    summary['keyframes'] = telemetry.keyframes.max()
+    summary['map_points'] = telemetry.map_points.max()
+    summary['local_mapping_queue_max'] = telemetry.local_mapping_queue.max()
+    summary['loop_closing_queue_max'] = telemetry.loop_closing_queue.max()
+    return summary
+
+
+def summarize_run(paths):
+    """Summary table of the telemetry files {video id: path}, one row per video and a last 'all' row.
+
+    Videos without a telemetry file (e.g. failed before tracking started) are left out.
+    The 'all' row pools the frames of every video, so its percentiles are those of the run.
+    """
+    telemetry = {video_id: read_telemetry(path) for video_id, path in sorted(paths.items()) if os.path.isfile(path)}
+    if not telemetry:
+        return pd.DataFrame()
+    rows = {video_id: summarize(t) for video_id, t in telemetry.items()}
+    rows['all'] = summarize(pd.concat(list(telemetry.values())))
+    table = pd.DataFrame.from_dict(rows, orient='index')
+    table.index.name = 'video'
+    return table
+
+
+def print_summary(table):
+    if len(table) == 0:
+        print('No telemetry found')
+        return
+    columns = ['frames', 'lost_ratio', 'track_time_p50', 'track_time_p99', 'image_wait_total', 'frames_per_sec',
+               'local_mapping_queue_max']
+    print(table[[c for c in columns if c in table.columns]].to_string(float_format='{:.4f}'.format))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize the per frame telemetry of extract_mono_epic")
+    parser.add_argument("files", nargs='+', help="_telemetry.csv files of extract_mono_epic")
+    parser.add_argument("--save", help="write the summary table to this csv")
+    args = parser.parse_args()
+
+    table = summarize_run({os.path.relpath(path): path for path in args.files})
+    print_summary(table)
+    if args.save:
+        table.to_csv(args.save)
@@ -0,0 +1,81 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extract_positions_main
+from extract_positions_main import process_sub_video, run_cpp_worker, sub_video_files, video_job
+from video_index import VideoIndex
+
+
+def make_video(path, frames):
+    os.makedirs(os.path.join(path, 'pos_info'))
+    for frame in frames:
+        open(os.path.join(path, 'frame_{:010d}.jpg'.format(frame)), 'w').close()
+
+
+def test_process_sub_video_writes_image_list(tmp_path, monkeypatch):
+    video_path = str(tmp_path / 'P01' / 'P01_01')
+    make_video(video_path, range(1, 31))
+    video_index = VideoIndex(str(tmp_path / 'video_index.csv'))
+    video_index.update('P01_01', video_path)
+
+    calls = []
+
+    def fake_run_cpp(settings_file, frames_file, prefix, *args):
+        calls.append((frames_file, prefix))
+        return 7
+
+    # stop after the image list stage, extract_mono_epic is not run
+    monkeypatch.setattr(extract_positions_main, 'run_cpp', fake_run_cpp)
+    job = video_job(video_path, 'pos_info', 'P01_01', video_index, fps=30, use_cache=False)
+    assert process_sub_video(**job) == 7
+
+    frames_file, prefix = sub_video_files(video_path, 'pos_info', 0, 30)
+    assert calls == [(frames_file, prefix)]
+    with open(frames_file) as f:
+        lines = [line.split() for line in f]
+    assert [name for _, name in lines] == [os.path.join(video_path, 'frame_{:010d}.jpg'.format(frame))
+                                           for frame in range(1, 31, 2)]
+    assert [float(t) for t, _ in lines] == [round(frame / 60.0, 6) for frame in range(1, 31, 2)]
+
+
+def test_slam_stage_keys_loaded_vocabulary_by_stat(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('Vocabulary')
+    with open('Vocabulary/ORBvoc.txt', 'w') as f:
+        f.write('text vocabulary')
+    frames_file = str(tmp_path / 'rgb_0_30.txt')
+    open(frames_file, 'w').close()
+
+    inputs, params, _ = extract_positions_main.slam_stage(frames_file, 'prefix', 'fixed', 'text')
+    assert 'Vocabulary/ORBvoc.txt' not in inputs
+    assert list(params['binaries']) == ['Vocabulary/ORBvoc.txt', extract_positions_main.SLAM_EXECUTABLE]
+
+    # the binary vocabulary is loaded once it exists, a newer one changes the key
+    with open('Vocabulary/ORBvoc.bin', 'w') as f:
+        f.write('binary vocabulary')
+    _, params, _ = extract_positions_main.slam_stage(frames_file, 'prefix', 'fixed', 'text')
+    assert params['binaries']['Vocabulary/ORBvoc.bin'] is not None
+    before = params['binaries']['Vocabulary/ORBvoc.bin']
+    os.utime('Vocabulary/ORBvoc.bin', ns=(0, before[1] + 10 ** 9))
+    _, params, _ = extract_positions_main.slam_stage(frames_file, 'prefix', 'fixed', 'text')
+    assert params['binaries']['Vocabulary/ORBvoc.bin'] != before
+
+
+def test_run_cpp_worker_many_jobs_with_output(tmp_path, monkeypatch):
+    # a stand-in for extract_mono_epic --jobs: reads one job at a time and prints a lot for each
+    worker = tmp_path / 'fake_worker.sh'
+    worker.write_text('#!/bin/sh\n'
+                      'while read frames prefix; do\n'
+                      '  head -c 70000 /dev/zero | tr "\\0" "x"; echo\n'
+                      '  echo "Finished job: $prefix status: 0"\n'
+                      'done < "$4"\n')
+    worker.chmod(0o755)
+    monkeypatch.setattr(extract_positions_main, 'SLAM_EXECUTABLE', str(worker))
+    settings = tmp_path / 'config.yaml'
+    settings.write_text('')
+
+    jobs = [('{}/rgb_{}.txt'.format(tmp_path, i), '{}/PosInfo_{}'.format(tmp_path, i) + 'p' * 200) for i in range(500)]
+    status = run_cpp_worker(str(settings), jobs, str(tmp_path / 'jobs.txt'), 0, str(tmp_path / 'log.txt'))
+    assert status == {prefix: 0 for _, prefix in jobs}
@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from contextlib import redirect_stdout
+from benchmark_pipeline import make_sequence
+from extract_valid_positions import extract, trajectory_files
+
+
+def touch(path, mtime):
+    open(path, 'w').close()
+    os.utime(path, (mtime, mtime))
+
+
+def test_trajectory_files_reads_the_newer_output(tmp_path):
+    prefix = str(tmp_path / 'PosInfo_0_100')
+    for name in ['Frame', 'keyFrame']:
+        touch('{}_{}.npy'.format(prefix, name), 1000)
+        touch('{}_{}.txt'.format(prefix, name), 2000)
+    assert trajectory_files(prefix) == (prefix + '_Frame.txt', prefix + '_keyFrame.txt')
+
+    for name in ['Frame', 'keyFrame']:
+        touch('{}_{}.npy'.format(prefix, name), 3000)
+    assert trajectory_files(prefix) == (prefix + '_Frame.npy', prefix + '_keyFrame.npy')
+
+
+def test_trajectory_files_single_format(tmp_path):
+    prefix = str(tmp_path / 'PosInfo_0_100')
+    touch(prefix + '_Frame.txt', 1000)
+    assert trajectory_files(prefix) == (prefix + '_Frame.txt', prefix + '_keyFrame.txt')
+
+
+def test_extract_text_and_npy_give_the_same_valid_frames(tmp_path):
+    results = {}
+    for ext in ['txt', 'npy']:
+        save_path = tmp_path / ext
+        save_path.mkdir()
+        prefix = str(save_path / 'PosInfo_0_6000')
+        make_sequence(prefix, 6000, seed=3, npy=True)
+        os.remove('{}_Frame.{}'.format(prefix, 'npy' if ext == 'txt' else 'txt'))
+        os.remove('{}_keyFrame.{}'.format(prefix, 'npy' if ext == 'txt' else 'txt'))
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            extract(5, 0.01, prefix, str(save_path))
+        results[ext] = pd.read_csv(str(save_path / 'validFrame.csv'), index_col=0)
+    assert len(results['txt']) > 0
+    pd.testing.assert_frame_equal(results['txt'], results['npy'])
+
+
+def test_extract_streamed_matches_bulk(tmp_path):
+    prefix = str(tmp_path / 'PosInfo_0_6000')
+    make_sequence(prefix, 6000, seed=3)
+    results = {}
+    for chunk_size in [None, 1000, 777]:
+        save_path = tmp_path / str(chunk_size)
+        save_path.mkdir()
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results[chunk_size] = extract(5, 0.01, prefix, str(save_path), chunk_size)
+        for name in ['Frame.csv', 'keyFrame.csv', 'validFrame.csv']:
+            with open(str(save_path / name)) as f, open(str(tmp_path / 'None' / name)) as g:
+                assert f.read() == g.read(), name
+    assert len(results[None][0]) > 0
+    assert results[1000] == results[None] == results[777]
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stage_cache import StageCache
+
+
+def test_writers_sharing_a_manifest_keep_each_others_stages(tmp_path):
+    manifest = str(tmp_path / 'cache.json')
+    outputs = {}
+    for data_id in ['P01', 'P02', 'P03']:
+        outputs[data_id] = str(tmp_path / data_id)
+        open(outputs[data_id], 'w').close()
+
+    # two extract_examples runs started before either saved anything
+    first, second = StageCache(manifest), StageCache(manifest)
+    first.update('P01', [], {}, [outputs['P01']])
+    second.update('P02', [], {}, [outputs['P02']])
+    first.update('P03', [], {}, [outputs['P03']])
+    second.invalidate('P02')
+
+    cache = StageCache(manifest)
+    assert sorted(cache.stages) == ['P01', 'P03']
+    assert cache.fresh('P01', [], {}, [outputs['P01']])
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')] == []
@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+import tarfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extract_positions_main import create_img_list
+from frame_store import FrameStore, video_archive
+from tar_extract import index_tar, unzip_tars
+
+
+def test_index_keeps_long_member_names(tmp_path):
+    subdir = 'd' * 150
+    tar_path = str(tmp_path / 'P01_01.tar')
+    with tarfile.open(tar_path, 'w') as tar:
+        for frame in [1, 2]:
+            data = 'jpeg {}'.format(frame).encode()
+            info = tarfile.TarInfo('{}/frame_{:010d}.jpg'.format(subdir, frame))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    index = index_tar(tar_path)
+    assert index['name'].tolist() == ['{}/frame_{:010d}.jpg'.format(subdir, frame) for frame in [1, 2]]
+    store = FrameStore(tar_path, subdir)
+    assert store.frames.tolist() == [1, 2]
+    assert store.read(2) == b'jpeg 2'
+    store.close()
+
+
+def test_extract_after_index_reads_extracted_frames(tmp_path):
+    data_path = str(tmp_path / 'P01')
+    os.makedirs(data_path)
+    with tarfile.open(os.path.join(data_path, 'P01_01.tar'), 'w') as tar:
+        for frame in [1, 2, 3]:
+            data = 'jpeg {}'.format(frame).encode()
+            info = tarfile.TarInfo('./frame_{:010d}.jpg'.format(frame))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    assert unzip_tars([data_path], index=True) == []
+    video_path = os.path.join(data_path, 'P01_01')
+    assert video_archive(video_path) is not None
+    assert unzip_tars([data_path]) == []
+    assert sorted(os.listdir(data_path)) == ['P01_01']
+    assert video_archive(video_path) is None
+
+    os.makedirs(os.path.join(video_path, 'pos_info'))
+    create_img_list(video_path, 'pos_info', 0, 3, fps=60, ori_fps=60)
+    with open(os.path.join(video_path, 'pos_info', 'rgb_0_3.txt')) as f:
+        names = [line.split()[1] for line in f]
+    assert names == [os.path.join(video_path, 'frame_{:010d}.jpg'.format(frame)) for frame in [1, 2, 3]]
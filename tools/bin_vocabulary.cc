@@ -0,0 +1,72 @@
+/**
+* This file is part of ORB-SLAM2.
+*
+* Copyright (C) 2014-2016 Raúl Mur-Artal <raulmur at unizar dot es> (University of Zaragoza)
+* For more information see <https://github.com/raulmur/ORB_SLAM2>
+*
+* ORB-SLAM2 is free software: you can redistribute it and/or modify
+* it under the terms of the GNU General Public License as published by
+* the Free Software Foundation, either version 3 of the License, or
+* (at your option) any later version.
+*
+* ORB-SLAM2 is distributed in the hope that it will be useful,
+* but WITHOUT ANY WARRANTY; without even the implied warranty of
+* MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+* GNU General Public License for more details.
+*
+* You should have received a copy of the GNU General Public License
+* along with ORB-SLAM2. If not, see <http://www.gnu.org/licenses/>.
+*/
+
+
+
+#include<iostream>
+#include<string>
+
+#include "ORBVocabulary.h"
+
+using namespace std;
+
+// Converts the text ORB vocabulary into the binary format loaded by System,
+// e.g. ./tools/bin_vocabulary Vocabulary/ORBvoc.txt Vocabulary/ORBvoc.bin
+int main(int argc, char **argv)
+{
+    if(argc != 2 && argc != 3)
+    {
+        cerr << endl << "Usage: ./bin_vocabulary path_to_text_vocabulary (path_to_binary_vocabulary)" << endl;
+        return 1;
+    }
+
+    string strTxtFile = string(argv[1]);
+    string strBinFile;
+    if(argc == 3)
+        strBinFile = string(argv[2]);
+    else if(strTxtFile.size()>4 && strTxtFile.compare(strTxtFile.size()-4,4,".txt")==0)
+        strBinFile = strTxtFile.substr(0,strTxtFile.size()-4) + ".bin";
+    else
+        strBinFile = strTxtFile + ".bin";
+
+    ORB_SLAM2::ORBVocabulary voc;
+    cout << "Loading text vocabulary " << strTxtFile << " ..." << endl;
+    if(!voc.loadFromTextFile(strTxtFile))
+    {
+        cerr << "Failed to load vocabulary at: " << strTxtFile << endl;
+        return 1;
+    }
+
+    cout << "Saving binary vocabulary " << strBinFile << " ..." << endl;
+    if(!voc.saveToBinaryFile(strBinFile))
+    {
+        cerr << "Failed to save vocabulary at: " << strBinFile << endl;
+        return 1;
+    }
+
+    ORB_SLAM2::ORBVocabulary check;
+    if(!check.loadFromBinaryFile(strBinFile) || check.size() != voc.size())
+    {
+        cerr << "Binary vocabulary does not load back correctly: " << strBinFile << endl;
+        return 1;
+    }
+    cout << "Done! " << voc.size() << " words." << endl;
+    return 0;
+}
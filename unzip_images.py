@@ -1,15 +1,22 @@
 import os
 import argparse
-import tarfile
+from tar_extract import unzip_tars
+from data_roots import add_root_arguments, resolve_roots
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_split", help="train or test")
     parser.add_argument("--data_id", help="PXX")
-    args = parser.parse_args()
+    parser.add_argument("--jobs", default=1, type=int, help="number of archives extracted in parallel")
+    parser.add_argument("--keep", help="keep archives after extracting them", action="store_true")
+    parser.add_argument("--index", help="only index archives so that frames are read from them without extracting",
+                        action="store_true")
+    parser.add_argument("--skip_indexed", help="leave archives that are already indexed", action="store_true")
+    add_root_arguments(parser)
+    args = resolve_roots(parser.parse_args())
 
-    data_path_prefix = '/media/hdd1/guanjq/EPIC_KITCHENS_2018/frames_rgb_flow/flow/'
+    data_path_prefix = args.flow_root
     data_split = args.data_split
     root_path = os.path.join(data_path_prefix, data_split)
     if args.data_id == 'A':
@@ -18,17 +25,4 @@ if __name__ == '__main__':
         data_path_list = [os.path.join(root_path, args.data_id)]
 
     # unzip file if needed
-    for data_path in data_path_list:
-        print('Data Path: ', data_path)
-        to_unzip_file = [f for f in os.listdir(data_path) if f.endswith('.tar')]
-        if not to_unzip_file:
-            print('There is no file to be unzipped!')
-        else:
-            print('unzip {} file(s): '.format(len(to_unzip_file)), to_unzip_file)
-            for file in to_unzip_file:
-                file_dir = file.split('.')[0]
-                tar = tarfile.open(os.path.join(data_path, file), "r:")
-                tar.extractall(os.path.join(data_path, file_dir))
-                tar.close()
-                print('unzip {} and remove it.'.format(file))
-                os.remove(os.path.join(data_path, file))
+    unzip_tars(data_path_list, args.jobs, remove=not args.keep, skip_indexed=args.skip_indexed, index=args.index)
@@ -0,0 +1,123 @@
+import os
+import socket
+import numpy as np
+import pandas as pd
+from frame_store import FrameStore, video_archive
+from tar_extract import index_path, is_indexed
+
+
+VIDEO_INDEX_FILE = 'video_index.csv'
+VIDEO_INDEX_COLUMNS = ['num_frames', 'first_frame', 'last_frame', 'fps', 'mtime']
+DEFAULT_FPS = 60
+
+
+def frame_source(video_path):
+    """The file or directory whose modification tells that the frames of a video changed."""
+    archive = video_archive(video_path)
+    return index_path(archive) if archive is not None else video_path
+
+
+def list_videos(data_path, archives=False):
+    """Sorted ids of the videos of a participant directory.
+
+    Videos are frame directories (P01_01) and indexed archives (P01_01.tar), which are read
+    without extracting them. With archives, archives that are not extracted yet are listed too.
+    """
+    names = os.listdir(data_path)
+    videos = set(f for f in names if f.startswith('P') and os.path.isdir(os.path.join(data_path, f)))
+    videos.update(f[:-len('.tar')] for f in names
+                  if f.endswith('.tar') and (archives or is_indexed(os.path.join(data_path, f))))
+    return sorted(videos)
+
+
+def scan_frames(video_path):
+    """Sorted frame numbers of the frame_{:010d}.jpg files of a video, from one directory scan.
+
+    Videos kept as indexed archives are read from the archive index instead.
+    """
+    archive = video_archive(video_path)
+    if archive is not None:
+        return FrameStore(archive).frames
+    with os.scandir(video_path) as entries:
+        frames = [int(entry.name[6:-4]) for entry in entries
+                  if entry.name.startswith('frame_') and entry.name.endswith('.jpg')]
+    return np.sort(np.array(frames, dtype=np.int64))
+
+
+def read_video_info(video_info_file):
+    """{video id: fps rounded to int} from EPIC_video_info.csv, empty if the file doesn't exist."""
+    if video_info_file is None or not os.path.isfile(video_info_file):
+        print('Video info file not found: {}'.format(video_info_file))
+        return {}
+    video_info = pd.read_csv(video_info_file)
+    return dict(zip(video_info.video, np.round(video_info.fps.values).astype(int).tolist()))
+
+
+class VideoIndex(object):
+    """Number of frames and fps of every video of a split, kept in a csv next to the videos.
+
+    A video is scanned once; its row is reused as long as the mtime of its frame directory
+    (or archive index) is unchanged. Frames of a video are numbered first_frame..last_frame,
+    so the frame list of a video without gaps follows from the frame_{:010d}.jpg naming and
+    is never listed again. fps comes from EPIC_video_info.csv, DEFAULT_FPS if it is missing.
+    """
+
+    def __init__(self, path, video_info_file=None):
+        self.path = path
+        self.video_fps = read_video_info(video_info_file)
+        if os.path.isfile(path):
+            self.table = pd.read_csv(path, index_col=0)
+        else:
+            self.table = pd.DataFrame(columns=VIDEO_INDEX_COLUMNS, dtype=np.int64)
+        self.updated = set()
+        self._frames = {}
+
+    def __contains__(self, video_id):
+        return video_id in self.table.index
+
+    def update(self, video_id, video_path):
+        """Scan the frames of a video unless its indexed row is up to date. Returns the row."""
+        mtime = os.stat(frame_source(video_path)).st_mtime_ns
+        if video_id in self.table.index and self.table.at[video_id, 'mtime'] == mtime:
+            return self.table.loc[video_id]
+        frames = scan_frames(video_path)
+        self._frames[video_id] = frames
+        first, last = (int(frames[0]), int(frames[-1])) if len(frames) else (0, -1)
+        self.table.loc[video_id] = [len(frames), first, last, self.fps(video_id), mtime]
+        self.updated.add(video_id)
+        return self.table.loc[video_id]
+
+    def num_frames(self, video_id):
+        return int(self.table.at[video_id, 'num_frames'])
+
+    def fps(self, video_id):
+        if video_id in self.video_fps:
+            return self.video_fps[video_id]
+        if video_id in self.table.index:
+            return int(self.table.at[video_id, 'fps'])
+        return DEFAULT_FPS
+
+    def frames(self, video_id, video_path):
+        """Sorted frame numbers of an indexed video."""
+        first, last, n = [int(self.table.at[video_id, c]) for c in ['first_frame', 'last_frame', 'num_frames']]
+        if last - first + 1 == n:
+            return np.arange(first, last + 1)
+        if video_id not in self._frames:
+            self._frames[video_id] = scan_frames(video_path)
+        return self._frames[video_id]
+
+    def save(self):
+        """Write the updated rows, merged with the rows saved meanwhile by other processes.
+
+        Every writer uses its own temporary file, so processes on several hosts can save the
+        same index; a row lost to a concurrent save is scanned again on the next update.
+        """
+        table = pd.read_csv(self.path, index_col=0) if os.path.isfile(self.path) else self.table.iloc[:0]
+        updated = self.table.loc[sorted(self.updated)]
+        table = pd.concat([table.drop(updated.index, errors='ignore'), updated]).sort_index()
+        tmp_path = '{}.{}.{}.tmp'.format(self.path, socket.gethostname(), os.getpid())
+        table.index.name = 'video'
+        table.astype(np.int64).to_csv(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.table = table
+        self.updated = set()